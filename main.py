@@ -1,35 +1,39 @@
 """The central program that ties all the modules together."""
 
 import time
-from src.modules.bot import Bot
-from src.modules.capture import Capture
-from src.modules.notifier import Notifier
-from src.modules.listener import Listener
-from src.modules.gui import GUI
 
 
-bot = Bot()
-capture = Capture()
-notifier = Notifier()
-listener = Listener()
+# Worker processes, such as the rune model's, are started by re-importing this file,
+# so everything must only run when it is executed directly
+if __name__ == '__main__':
+    from src.modules.bot import Bot
+    from src.modules.capture import Capture
+    from src.modules.notifier import Notifier
+    from src.modules.listener import Listener
+    from src.modules.gui import GUI
 
-bot.start()
-while not bot.ready:
-    time.sleep(0.01)
+    bot = Bot()
+    capture = Capture()
+    notifier = Notifier()
+    listener = Listener()
 
-capture.start()
-while not capture.ready:
-    time.sleep(0.01)
+    bot.start()
+    while not bot.ready:
+        time.sleep(0.01)
 
-notifier.start()
-while not notifier.ready:
-    time.sleep(0.01)
+    capture.start()
+    while not capture.ready:
+        time.sleep(0.01)
 
-listener.start()
-while not listener.ready:
-    time.sleep(0.01)
+    notifier.start()
+    while not notifier.ready:
+        time.sleep(0.01)
 
-print('\n[~] Successfully initialized Auto Maple')
+    listener.start()
+    while not listener.ready:
+        time.sleep(0.01)
 
-gui = GUI()
-gui.start()
+    print('\n[~] Successfully initialized Auto Maple')
+
+    gui = GUI()
+    gui.start()
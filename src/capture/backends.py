@@ -0,0 +1,233 @@
+"""Interchangeable sources of frames for Capture, either live from the game or replayed from disk."""
+
+import os
+import time
+import cv2
+import numpy as np
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+
+
+class CaptureError(Exception):
+    """Raised by a CaptureBackend when it temporarily fails to produce a frame."""
+
+
+class CaptureBackend:
+    """
+    A source of BGRA frames. Backends are opened and closed by Capture each time it
+    recalibrates, and are asked to locate the game window before every calibration.
+    """
+
+    def open(self):
+        """Acquires any resources needed to take screenshots."""
+
+    def close(self):
+        """Releases the resources acquired by open."""
+
+    def find_window(self):
+        """
+        Locates the game window.
+        :return:    The window's (left, top, right, bottom) coordinates in pixels.
+        """
+
+        raise NotImplementedError
+
+    def advance(self):
+        """Called once per Capture iteration, before any frames are grabbed."""
+
+    def grab(self, region):
+        """
+        Takes a screenshot of REGION.
+        :param region:  A dictionary with 'left', 'top', 'width' and 'height' keys.
+        :return:        The screenshot as a BGRA array.
+        """
+
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MssBackend(CaptureBackend):
+    """Captures the MapleStory window on Windows using mss and the Win32 API."""
+
+    WINDOW_NAME = 'MapleStory'
+
+    def __init__(self):
+        import ctypes
+        import mss
+        import mss.windows
+
+        self.ctypes = ctypes
+        self.mss = mss
+        self.user32 = ctypes.windll.user32
+        self.user32.SetProcessDPIAware()
+        mss.windows.CAPTUREBLT = 0
+        self.sct = None
+
+    def open(self):
+        self.sct = self.mss.mss()
+
+    def close(self):
+        self.sct.close()
+        self.sct = None
+
+    def find_window(self):
+        from ctypes import wintypes
+
+        handle = self.user32.FindWindowW(None, MssBackend.WINDOW_NAME)
+        rect = wintypes.RECT()
+        self.user32.GetWindowRect(handle, self.ctypes.pointer(rect))
+        return rect.left, rect.top, rect.right, rect.bottom
+
+    def grab(self, region):
+        try:
+            shot = self.sct.grab(region)
+        except self.mss.exception.ScreenShotError as e:
+            raise CaptureError(e)
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+
+class ReplayBackend(CaptureBackend):
+    """
+    Streams previously recorded frames from a directory of PNGs, a directory of .npz chunks
+    saved by Recorder, an .npy array of shape (frames, height, width, channels), or a video
+    file. Frames are either played back at the rate at which they were recorded or as fast
+    as Capture can consume them.
+    """
+
+    DEFAULT_FPS = 30
+
+    def __init__(self, path, realtime=True, loop=False, fps=None):
+        """
+        Creates a new ReplayBackend.
+        :param path:        The recording to replay.
+        :param realtime:    Whether to respect the recorded frame rate.
+        :param loop:        Whether to restart from the first frame once the recording ends.
+        :param fps:         Overrides the recorded frame rate.
+        """
+
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = False
+
+        self.files = None
+        self.chunks = None
+        self.array = None
+        self.video = None
+        timestamps = None
+        timestamps_dir = os.path.dirname(path)
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            chunks = [os.path.join(path, f) for f in names
+                      if f.startswith('chunk_') and f.endswith('.npz')]
+            if chunks:
+                self.chunks = []
+                timestamps = []
+                for chunk in chunks:
+                    with np.load(chunk) as data:
+                        timestamps.append(data['timestamps'])
+                    self.chunks.extend((chunk, i) for i in range(len(timestamps[-1])))
+                timestamps = np.concatenate(timestamps)
+                length = len(self.chunks)
+            else:
+                self.files = [os.path.join(path, f) for f in names if f.lower().endswith('.png')]
+                length = len(self.files)
+            timestamps_dir = path
+        elif path.lower().endswith('.npy'):
+            self.array = np.load(path, mmap_mode='r')
+            length = len(self.array)
+        elif path.lower().endswith(VIDEO_EXTENSIONS):
+            self.video = cv2.VideoCapture(path)
+            length = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        else:
+            raise ValueError(f"'{path}' is not a supported recording")
+        if length == 0:
+            raise ValueError(f"Recording '{path}' does not contain any frames")
+        self.length = length
+
+        # Use the recorded timestamps if they exist, otherwise assume a constant frame rate
+        timestamps_path = os.path.join(timestamps_dir, 'timestamps.npy')
+        if timestamps is None and os.path.isfile(timestamps_path):
+            timestamps = np.load(timestamps_path)[:length]
+        if fps is None and timestamps is not None:
+            self.offsets = timestamps - timestamps[0]
+        else:
+            if fps is None and self.video is not None:
+                fps = self.video.get(cv2.CAP_PROP_FPS) or None
+            self.offsets = np.arange(length) / (fps or ReplayBackend.DEFAULT_FPS)
+
+        self.index = -1
+        self.frame = None
+        self.chunk = (None, None)
+        self.start_time = None
+        self._read(0)
+
+    def open(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+
+    def find_window(self):
+        height, width = self.frame.shape[:2]
+        return 0, 0, width, height
+
+    def advance(self):
+        if self.finished:
+            time.sleep(0.01)
+            return
+        if self.realtime:
+            elapsed = time.time() - self.start_time
+            index = int(np.searchsorted(self.offsets, elapsed, side='right')) - 1
+            if index == self.index:
+                if index + 1 < self.length:
+                    time.sleep(max(0, self.offsets[index + 1] - elapsed))
+                index += 1
+        else:
+            index = self.index + 1
+
+        if index >= self.length:
+            if self.loop:
+                self.start_time = time.time()
+                index = 0
+            else:
+                print(f"\n[~] Finished replaying '{self.path}'")
+                self.finished = True
+                return
+        self._read(index)
+
+    def grab(self, region):
+        left, top = region['left'], region['top']
+        return self.frame[top:top + region['height'], left:left + region['width']]
+
+    def _read(self, index):
+        """Loads the frame at INDEX and converts it to BGRA to match live screenshots."""
+
+        if self.files is not None:
+            frame = cv2.imread(self.files[index], cv2.IMREAD_UNCHANGED)
+        elif self.chunks is not None:
+            path, i = self.chunks[index]
+            if self.chunk[0] != path:
+                with np.load(path) as data:
+                    self.chunk = (path, data['frames'])
+            frame = self.chunk[1][i]
+        elif self.array is not None:
+            frame = np.asarray(self.array[index])
+        else:
+            if index != self.index + 1:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
+            _, frame = self.video.read()
+        if frame is None:
+            raise CaptureError(f"Could not read frame {index} of '{self.path}'")
+
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGRA)
+        elif frame.shape[2] == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+        self.frame = frame
+        self.index = index
@@ -0,0 +1,144 @@
+"""Locates the minimap within the game window and remembers where it was found."""
+
+import os
+import pickle
+import cv2
+from src.detection import matching
+
+
+# The distance between the top of the minimap and the top of the screen
+MINIMAP_TOP_BORDER = 5
+
+# The thickness of the other three borders of the minimap
+MINIMAP_BOTTOM_BORDER = 9
+
+# The top-left and bottom-right corners of the minimap
+MM_TL_TEMPLATE = cv2.imread('assets/minimap_tl_template.png', 0)
+MM_BR_TEMPLATE = cv2.imread('assets/minimap_br_template.png', 0)
+
+matching.register('minimap_tl', MM_TL_TEMPLATE, pyramid=1)
+matching.register('minimap_br', MM_BR_TEMPLATE, pyramid=1)
+
+MMT_HEIGHT = max(MM_TL_TEMPLATE.shape[0], MM_BR_TEMPLATE.shape[0])
+MMT_WIDTH = max(MM_TL_TEMPLATE.shape[1], MM_BR_TEMPLATE.shape[1])
+
+
+class Calibration:
+    """The location of the minimap's interior within the game window."""
+
+    def __init__(self, mm_tl, mm_br, window):
+        """
+        Creates a new Calibration.
+        :param mm_tl:   The top-left corner of the minimap's interior, relative to the window.
+        :param mm_br:   The bottom-right corner of the minimap's interior, relative to the window.
+        :param window:  The game window's position and size on the screen.
+        """
+
+        self.mm_tl = mm_tl
+        self.mm_br = mm_br
+        self.ratio = (mm_br[0] - mm_tl[0]) / (mm_br[1] - mm_tl[1])
+        self.region = {
+            'left': window['left'] + mm_tl[0],
+            'top': window['top'] + mm_tl[1],
+            'width': mm_br[0] - mm_tl[0],
+            'height': mm_br[1] - mm_tl[1]
+        }
+
+    def crop(self, frame):
+        """Returns the minimap within FRAME, a screenshot of the entire game window."""
+
+        return frame[self.mm_tl[1]:self.mm_br[1], self.mm_tl[0]:self.mm_br[0]]
+
+    def verify(self, frame):
+        """Returns whether the minimap is still where this Calibration says it is in FRAME."""
+
+        return verify_minimap(frame, self.mm_tl, self.mm_br)
+
+
+def find_minimap(frame, min_width, min_height):
+    """
+    Searches all of FRAME for the corners of the minimap.
+    :param frame:       A screenshot of the entire game window.
+    :param min_width:   The minimum width of the minimap's interior.
+    :param min_height:  The minimum height of the minimap's interior.
+    :return:            The top-left and bottom-right corners of the minimap's interior.
+    """
+
+    x, y, _ = matching.best(frame, 'minimap_tl')
+    tl = (int(round(x - MM_TL_TEMPLATE.shape[1] / 2)), int(round(y - MM_TL_TEMPLATE.shape[0] / 2)))
+    x, y, _ = matching.best(frame, 'minimap_br')
+    br = (int(round(x + MM_BR_TEMPLATE.shape[1] / 2)), int(round(y + MM_BR_TEMPLATE.shape[0] / 2)))
+    mm_tl = (
+        tl[0] + MINIMAP_BOTTOM_BORDER,
+        tl[1] + MINIMAP_TOP_BORDER
+    )
+    mm_br = (
+        max(mm_tl[0] + min_width, br[0] - MINIMAP_BOTTOM_BORDER),
+        max(mm_tl[1] + min_height, br[1] - MINIMAP_BOTTOM_BORDER)
+    )
+    return mm_tl, mm_br
+
+
+def verify_minimap(frame, mm_tl, mm_br, threshold=0.9, slack=2):
+    """
+    Cheaply checks whether the minimap corners are still at the given positions by only
+    matching the corner templates within small patches around where they should be.
+    :param frame:       A screenshot of the entire game window.
+    :param mm_tl:       The expected top-left corner of the minimap's interior.
+    :param mm_br:       The expected bottom-right corner of the minimap's interior.
+    :param threshold:   The minimum normalized correlation of each corner.
+    :param slack:       How many pixels each corner is allowed to have drifted.
+    :return:            Whether both corners were found.
+    """
+
+    tl = (mm_tl[0] - MINIMAP_BOTTOM_BORDER, mm_tl[1] - MINIMAP_TOP_BORDER)
+    br = (
+        mm_br[0] + MINIMAP_BOTTOM_BORDER - MM_BR_TEMPLATE.shape[1],
+        mm_br[1] + MINIMAP_BOTTOM_BORDER - MM_BR_TEMPLATE.shape[0]
+    )
+    for (x, y), template in ((tl, MM_TL_TEMPLATE), (br, MM_BR_TEMPLATE)):
+        height, width = template.shape
+        left, top = max(0, x - slack), max(0, y - slack)
+        patch = frame[top:y + height + slack, left:x + width + slack]
+        if patch.shape[0] < height or patch.shape[1] < width:
+            return False
+        gray = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+        if result.max() < threshold:
+            return False
+    return True
+
+
+class CalibrationCache:
+    """
+    Remembers where the minimap was found for each combination of window size and map,
+    so that recalibrating only needs to verify the cached corners instead of searching
+    the entire window.
+    """
+
+    def __init__(self, target='calibration', directory='.settings'):
+        self.path = os.path.join(directory, target)
+        self.entries = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'rb') as file:
+                    self.entries = pickle.load(file)
+            except (pickle.UnpicklingError, EOFError):
+                self.entries = {}
+
+    def get(self, key):
+        """Returns the cached (mm_tl, mm_br) corners for KEY, otherwise None."""
+
+        return self.entries.get(key)
+
+    def put(self, key, mm_tl, mm_br):
+        """Saves the corners found for KEY to disk."""
+
+        if self.entries.get(key) == (mm_tl, mm_br):
+            return
+        self.entries[key] = (mm_tl, mm_br)
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, 'wb') as file:
+            pickle.dump(self.entries, file)
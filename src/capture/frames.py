@@ -0,0 +1,171 @@
+"""A fixed-size ring buffer of captured frames that consumers can wait on."""
+
+import time
+import threading
+import cv2
+import numpy as np
+from src.common import color
+
+
+class Frame:
+    """
+    A single slot in a FrameBuffer. Its image is reused once the buffer wraps around,
+    unless a consumer has pinned it. Images derived from it, such as its grayscale or HSV
+    conversions, are computed at most once per frame and shared between every consumer
+    that asks for them.
+    """
+
+    def __init__(self):
+        self.image = None
+        self.seq = 0            # 0 means that this slot does not hold a valid frame
+        self.timestamp = 0
+        self.pins = 0           # The number of consumers that are still using this frame
+        self.derived = {}
+        self.derived_seq = 0
+        self.lock = threading.RLock()
+
+    def derive(self, key, function):
+        """
+        Returns the image derived from this frame under KEY, computing it with FUNCTION
+        if it has not been computed yet for the current frame.
+        :param key:         A hashable name for the derived image.
+        :param function:    A function that takes this Frame and returns the derived image.
+        :return:            The derived image.
+        """
+
+        seq = self.seq
+        with self.lock:
+            if self.derived_seq != seq:
+                self.derived = {}
+                self.derived_seq = seq
+            if key not in self.derived:
+                self.derived[key] = function(self)
+            return self.derived[key]
+
+    def gray(self):
+        """Returns this frame in grayscale."""
+
+        return self.derive('gray', lambda f: cv2.cvtColor(f.image, cv2.COLOR_BGR2GRAY))
+
+    def hsv(self):
+        """Returns this frame in the HSV color space."""
+
+        return self.derive('hsv', lambda f: cv2.cvtColor(f.image, cv2.COLOR_BGR2HSV))
+
+    def mask(self, ranges):
+        """Returns a mask of the pixels in this frame that fall within any of the HSV RANGES."""
+
+        return self.derive(('mask', ranges), lambda f: color.mask(f.image, ranges, f.hsv()))
+
+    def thumbnail(self, scale):
+        """Returns this frame with its width and height reduced by a factor of SCALE."""
+
+        def function(f):
+            height, width = f.image.shape[:2]
+            size = (max(1, width // scale), max(1, height // scale))
+            return cv2.resize(f.image, size, interpolation=cv2.INTER_AREA)
+        return self.derive(('thumbnail', scale), function)
+
+    def filtered_gray(self, ranges):
+        """
+        Returns this frame in grayscale with every pixel outside of the HSV RANGES set to
+        black. Equivalent to converting the output of color.filter_color to grayscale.
+        """
+
+        return self.derive(('filtered_gray', ranges),
+                           lambda f: cv2.bitwise_and(f.gray(), f.gray(), mask=f.mask(ranges)))
+
+
+class FrameBuffer:
+    """
+    Holds the most recent frames taken by Capture in preallocated slots. Each frame is
+    tagged with a monotonically increasing sequence id and the time at which it was taken,
+    so consumers can tell new frames apart from ones they have already processed.
+
+    Consumers that use a frame for longer than it takes the buffer to wrap around must pin
+    it and release it once they are done. Pinned frames are never overwritten: the writer
+    gives their slot a new Frame instead, and the pinned one is discarded once released.
+    """
+
+    def __init__(self, size=8):
+        """
+        Creates a new FrameBuffer.
+        :param size:    The number of frames to keep before the oldest one is overwritten.
+        """
+
+        self.size = size
+        self.slots = [Frame() for _ in range(size)]
+        self.seq = 0
+        self.condition = threading.Condition()
+
+    def write(self, image, timestamp=None):
+        """
+        Copies IMAGE into the next slot and notifies any waiting consumers. A slot is
+        only reallocated if IMAGE has a different shape than the one it previously held.
+        :param image:       The image to store.
+        :param timestamp:   The time at which IMAGE was captured, defaults to now.
+        :return:            The Frame that IMAGE was written to.
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+        with self.condition:
+            index = self.seq % self.size
+            slot = self.slots[index]
+            if slot.pins > 0:
+                slot = self.slots[index] = Frame()
+            slot.seq = 0                # Invalidate the slot while it is being written to
+        if slot.image is None or slot.image.shape != image.shape or slot.image.dtype != image.dtype:
+            slot.image = np.empty_like(image)
+        np.copyto(slot.image, image)
+        with self.condition:
+            self.seq += 1
+            slot.seq = self.seq
+            slot.timestamp = timestamp
+            self.condition.notify_all()
+        return slot
+
+    def latest(self, pin=False):
+        """
+        Returns the most recently written Frame, otherwise None if the buffer is empty.
+        :param pin:     Whether to pin the Frame until it is passed to RELEASE.
+        """
+
+        with self.condition:
+            if self.seq == 0:
+                return None
+            return self._newest(pin)
+
+    def release(self, frame):
+        """Unpins FRAME, which was returned by this buffer with PIN set. Ignores None."""
+
+        if frame is not None:
+            with self.condition:
+                frame.pins -= 1
+
+    def get(self, seq):
+        """Returns the Frame with sequence id SEQ if it has not been overwritten yet."""
+
+        slot = self.slots[(seq - 1) % self.size]
+        if seq > 0 and slot.seq == seq:
+            return slot
+
+    def wait_for_frame(self, after_seq=0, timeout=None, pin=False):
+        """
+        Blocks until a frame newer than AFTER_SEQ is available.
+        :param after_seq:   The sequence id of the last frame that the caller has seen.
+        :param timeout:     The maximum number of seconds to wait, or None to wait forever.
+        :param pin:         Whether to pin the Frame until it is passed to RELEASE.
+        :return:            The newest Frame, otherwise None if TIMEOUT expired.
+        """
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            return self._newest(pin)
+
+    def _newest(self, pin):
+        frame = self.slots[(self.seq - 1) % self.size]
+        if pin:
+            frame.pins += 1
+        return frame
@@ -0,0 +1,57 @@
+"""Cheap change detection used to skip analyzing parts of the screen that have not changed."""
+
+import cv2
+
+
+class RegionWatcher:
+    """
+    Decides whether a region of the newest frame differs enough from the last time it was
+    analyzed to be worth analyzing again. Regions are compared using downscaled copies of
+    each frame, so checking a region costs far less than running a detector on it.
+    """
+
+    def __init__(self, max_staleness=1.0, threshold=12, scale=8):
+        """
+        Creates a new RegionWatcher.
+        :param max_staleness:   The maximum number of seconds between each analysis, even if
+                                the region has not changed at all.
+        :param threshold:       The smallest difference in any channel of any downscaled pixel
+                                that counts as a change.
+        :param scale:           How much to shrink each frame by before comparing it. Should be
+                                small enough for the features being detected to remain visible.
+        """
+
+        self.max_staleness = max_staleness
+        self.threshold = threshold
+        self.scale = scale
+        self.previous = None
+        self.last_run = 0
+
+    def reset(self):
+        """Forces the next check to report a change."""
+
+        self.previous = None
+
+    def check(self, frame, region=None):
+        """
+        Returns whether REGION of FRAME should be analyzed, which is the case if it changed
+        since the last time this returned True or if that was over MAX_STALENESS seconds ago.
+        :param frame:   The newest Frame.
+        :param region:  An optional (left, top, right, bottom) area of FRAME to watch.
+        :return:        True if the region needs to be analyzed again.
+        """
+
+        current = frame.thumbnail(self.scale)
+        if region is not None:
+            left, top, right, bottom = (x // self.scale for x in region)
+            current = current[top:bottom, left:right]
+
+        previous = self.previous
+        if previous is None \
+                or previous.shape != current.shape \
+                or frame.timestamp - self.last_run >= self.max_staleness \
+                or cv2.absdiff(previous, current).max() > self.threshold:
+            self.previous = current
+            self.last_run = frame.timestamp
+            return True
+        return False
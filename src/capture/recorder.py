@@ -0,0 +1,138 @@
+"""Records the frames seen by Capture, along with the bot's state, for offline replay and tuning."""
+
+import os
+import json
+import queue
+import threading
+import cv2
+import numpy as np
+
+
+RECORDINGS_DIR = 'recordings'
+
+
+class Recorder:
+    """
+    Saves frames submitted by Capture from a background writer thread. Frames are passed
+    through a bounded queue and are dropped, rather than waited on, if the writer falls behind
+    so that recording never slows down the capture loop.
+
+    Frames are either stored as compressed chunks of CHUNK_SIZE frames ('chunk_XXXXX.npz',
+    each holding 'frames', 'timestamps', 'player_pos', 'rune_active' and 'path'), or as a
+    single 'session.mp4' video with the per-frame metadata saved in 'metadata.npz' and
+    'timestamps.npy' once recording stops.
+    """
+
+    def __init__(self, directory, video=False, fps=20, chunk_size=20, queue_size=32):
+        """
+        Creates a new Recorder.
+        :param directory:   The directory in which to save the recording.
+        :param video:       Whether to encode frames as a video instead of .npz chunks.
+        :param fps:         The nominal frame rate of the video.
+        :param chunk_size:  The number of frames to store in each .npz chunk.
+        :param queue_size:  The maximum number of frames waiting to be written.
+        """
+
+        self.directory = directory
+        self.video = video
+        self.fps = fps
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.recorded = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self._main)
+        self.thread.daemon = True
+
+    def start(self):
+        """Starts this Recorder's writer thread."""
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        print(f"\n[~] Started recording to '{self.directory}'")
+        self.thread.start()
+
+    def stop(self):
+        """Flushes all queued frames to disk and stops the writer thread."""
+
+        self.queue.put(None)
+        self.thread.join()
+        print(f"\n[~] Finished recording {self.recorded} frames to '{self.directory}'"
+              + (f', dropped {self.dropped}' if self.dropped else ''))
+
+    def submit(self, frame, timestamp, player_pos, rune_active, path):
+        """
+        Queues a BGR copy of FRAME to be written along with its metadata. Never blocks.
+        :param frame:       The BGRA frame to record.
+        :param timestamp:   The time at which FRAME was captured.
+        :param player_pos:  The player's relative position on the minimap.
+        :param rune_active: Whether a rune was active.
+        :param path:        The path that the bot was following.
+        :return:            Whether FRAME was queued.
+        """
+
+        if self.queue.full():
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((frame[:, :, :3].copy(),
+                                   timestamp,
+                                   player_pos,
+                                   rune_active,
+                                   [tuple(p) for p in path]))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _main(self):
+        writer = None
+        chunk = []
+        metadata = []
+        index = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, timestamp, player_pos, rune_active, path = item
+            metadata.append((timestamp, player_pos, rune_active, path))
+            if self.video:
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(os.path.join(self.directory, 'session.mp4'),
+                                             cv2.VideoWriter_fourcc(*'mp4v'),
+                                             self.fps,
+                                             (width, height))
+                writer.write(frame)
+            else:
+                chunk.append(frame)
+                if len(chunk) == self.chunk_size:
+                    self._save_chunk(index, chunk, metadata)
+                    index += 1
+                    chunk = []
+                    metadata = []
+            self.recorded += 1
+
+        if self.video:
+            if writer is not None:
+                writer.release()
+            self._save_metadata(os.path.join(self.directory, 'metadata.npz'), metadata)
+            np.save(os.path.join(self.directory, 'timestamps.npy'),
+                    np.array([m[0] for m in metadata], dtype=np.float64))
+        elif chunk:
+            self._save_chunk(index, chunk, metadata)
+
+    def _save_chunk(self, index, frames, metadata):
+        path = os.path.join(self.directory, f'chunk_{index:05d}.npz')
+        self._save_metadata(path, metadata, frames=np.stack(frames))
+
+    @staticmethod
+    def _save_metadata(path, metadata, **arrays):
+        np.savez_compressed(
+            path,
+            timestamps=np.array([m[0] for m in metadata], dtype=np.float64),
+            player_pos=np.array([m[1] for m in metadata], dtype=np.float64).reshape(-1, 2),
+            rune_active=np.array([m[2] for m in metadata], dtype=bool),
+            path=np.array([json.dumps(m[3]) for m in metadata]),
+            **arrays
+        )
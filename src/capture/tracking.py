@@ -0,0 +1,219 @@
+"""Incremental tracking and smoothing of the player's position on the minimap."""
+
+import time
+import cv2
+import numpy as np
+
+
+# How many seconds the player can go unmeasured, beyond the requested lead, before predictions
+# stop extrapolating. This spans several minimap frames, so it is only exceeded when the
+# tracker has actually lost the player.
+MAX_MEASUREMENT_GAP = 0.1
+
+
+class PlayerTracker:
+    """
+    Locates the player on the minimap by searching a small window around their last known
+    position, only falling back to scanning the entire minimap when the local search fails.
+    """
+
+    def __init__(self, template, margin=15):
+        """
+        Creates a new PlayerTracker.
+        :param template:    The registered Template of the player's symbol. Its threshold is
+                            the minimum normalized correlation for a match to be accepted.
+        :param margin:      How many pixels around the last known position to search.
+        """
+
+        self.template = template.image
+        self.threshold = template.threshold
+        self.margin = margin
+        self.last = None            # Top-left corner of the previous match
+        self.confidence = 0
+
+    def reset(self):
+        """Forgets the player's last known position, forcing the next search to be global."""
+
+        self.last = None
+        self.confidence = 0
+
+    def locate(self, minimap):
+        """
+        Finds the player's symbol within MINIMAP.
+        :param minimap:     The BGR(A) minimap image.
+        :return:            The sub-pixel center of the best match and its score in [-1, 1],
+                            or (None, score) if no match exceeded the threshold.
+        """
+
+        height, width = minimap.shape[:2]
+        t_height, t_width = self.template.shape
+        if t_height > height or t_width > width:
+            return None, 0
+
+        if self.last is not None:
+            left = max(0, self.last[0] - self.margin)
+            top = max(0, self.last[1] - self.margin)
+            right = min(width, self.last[0] + t_width + self.margin)
+            bottom = min(height, self.last[1] + t_height + self.margin)
+            score, loc, offset = self._match(minimap[top:bottom, left:right])
+            if score >= self.threshold:
+                return self._accept((loc[0] + left, loc[1] + top), offset, score)
+
+        score, loc, offset = self._match(minimap)
+        if score >= self.threshold:
+            return self._accept(loc, offset, score)
+        self.last = None
+        self.confidence = score
+        return None, score
+
+    def _match(self, image):
+        """
+        Returns the best score and top-left location of the template within IMAGE, along with
+        the sub-pixel offset of the true peak from that location.
+        """
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        result = cv2.matchTemplate(gray, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(result)
+        return score, loc, refine_peak(result, loc)
+
+    def _accept(self, top_left, offset, score):
+        self.last = top_left
+        self.confidence = score
+        t_height, t_width = self.template.shape
+        center = (
+            top_left[0] + offset[0] + t_width / 2,
+            top_left[1] + offset[1] + t_height / 2
+        )
+        return center, score
+
+
+class PositionEstimator:
+    """
+    Smooths the player's measured position using a constant-velocity Kalman filter, and
+    estimates their velocity so that their position can be extrapolated to any point in time.
+    Positions are in the same relative units as config.player_pos.
+    """
+
+    def __init__(self, process_noise=4.0, measurement_noise=0.0025, gate=0.05):
+        """
+        Creates a new PositionEstimator.
+        :param process_noise:       How quickly the player's velocity is expected to change.
+        :param measurement_noise:   The standard deviation of each measured position.
+        :param gate:                Measurements further than this from the filter's prediction
+                                    are treated as teleports and restart the filter.
+        """
+
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.gate = gate
+        self.x = None
+        self.p = None
+        self.timestamp = 0
+        self.snapshot = None        # (timestamp, position, velocity), replaced atomically
+
+    def reset(self):
+        """Discards the filter's state."""
+
+        self.x = None
+        self.snapshot = None
+
+    @property
+    def position(self):
+        """The filtered position at the time of the latest measurement."""
+
+        snapshot = self.snapshot
+        return snapshot[1] if snapshot else None
+
+    @property
+    def velocity(self):
+        """The estimated velocity in relative units per second."""
+
+        snapshot = self.snapshot
+        return snapshot[2] if snapshot else (0, 0)
+
+    def predict(self, at=None, horizon=None):
+        """
+        Extrapolates the player's position to time AT.
+        :param at:          The time at which to estimate the position, defaults to now.
+        :param horizon:     The furthest to extrapolate past the latest measurement, in seconds.
+                            If AT is further away than that, the player was probably lost, so
+                            the last measured position is returned instead of drifting further.
+        :return:            The predicted position, or None if there have not been any
+                            measurements.
+        """
+
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        timestamp, position, velocity = snapshot
+        dt = (time.time() if at is None else at) - timestamp
+        if horizon is not None and dt > horizon:
+            return position
+        return position[0] + velocity[0] * dt, position[1] + velocity[1] * dt
+
+    def update(self, measurement, timestamp):
+        """
+        Incorporates a new measured position.
+        :param measurement:     The measured (x, y) position.
+        :param timestamp:       The time at which the frame containing MEASUREMENT was taken.
+        :return:                The filtered position.
+        """
+
+        z = np.array(measurement, dtype=np.float64)
+        r = self.measurement_noise ** 2
+        dt = timestamp - self.timestamp
+        if self.x is None:
+            self._restart(z, r)
+        elif dt > 0:
+            # Predict
+            f = np.eye(4)
+            f[0, 2] = f[1, 3] = dt
+            q = np.zeros((4, 4))
+            q[0, 0] = q[1, 1] = dt ** 3 / 3
+            q[0, 2] = q[2, 0] = q[1, 3] = q[3, 1] = dt ** 2 / 2
+            q[2, 2] = q[3, 3] = dt
+            x = f @ self.x
+            p = f @ self.p @ f.T + self.process_noise * q
+
+            # Update, unless the player has moved too far to be explained by the model
+            innovation = z - x[:2]
+            if np.hypot(*innovation) > self.gate:
+                self._restart(z, r)
+            else:
+                s = p[:2, :2] + np.eye(2) * r
+                k = p[:, :2] @ np.linalg.inv(s)
+                self.x = x + k @ innovation
+                self.p = p - k @ p[:2, :]
+        self.timestamp = timestamp
+        position = (float(self.x[0]), float(self.x[1]))
+        velocity = (float(self.x[2]), float(self.x[3]))
+        self.snapshot = (timestamp, position, velocity)
+        return position
+
+    def _restart(self, z, r):
+        self.x = np.array([z[0], z[1], 0, 0], dtype=np.float64)
+        self.p = np.diag([r, r, 1, 1])
+
+
+def refine_peak(result, loc):
+    """
+    Fits a parabola through the peak of a template matching RESULT and its neighbors
+    along each axis.
+    :param result:  The output of cv2.matchTemplate.
+    :param loc:     The (x, y) location of the maximum value in RESULT.
+    :return:        The (x, y) offset of the interpolated peak from LOC, each within [-0.5, 0.5].
+    """
+
+    x, y = loc
+    offset = [0.0, 0.0]
+    for axis, (i, length) in enumerate(((x, result.shape[1]), (y, result.shape[0]))):
+        if 0 < i < length - 1:
+            if axis == 0:
+                left, center, right = result[y, x - 1], result[y, x], result[y, x + 1]
+            else:
+                left, center, right = result[y - 1, x], result[y, x], result[y + 1, x]
+            denominator = left - 2 * center + right
+            if denominator < 0:
+                offset[axis] = float(np.clip((left - right) / (2 * denominator), -0.5, 0.5))
+    return tuple(offset)
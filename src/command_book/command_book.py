@@ -6,6 +6,7 @@ from os.path import basename, splitext
 from src.common import config, utils
 from src.routine import components
 from src.common.interfaces import Configurable
+from src.detection.detectors import Detector
 
 
 CB_KEYBINDING_DIR = os.path.join('resources', 'keybindings')
@@ -75,6 +76,12 @@ class CommandBook(Configurable):
             if issubclass(command, components.Command):
                 new_cb[name.lower()] = command
 
+        # Collect any detectors that the notifier should run while this command book is loaded
+        detectors = []
+        for name, detector in inspect.getmembers(module, inspect.isclass):
+            if issubclass(detector, Detector) and detector.__module__ == module.__name__:
+                detectors.append(detector())
+
         # Check if required commands have been implemented and overridden
         required_found = True
         for command in (components.Buff,):
@@ -101,6 +108,10 @@ class CommandBook(Configurable):
             config.gui.menu.file.enable_routine_state()
             config.gui.view.status.set_cb(basename(file))
             config.routine.clear()
+            if config.notifier is not None:
+                config.notifier.scheduler.replace('command_book', detectors)
+            for detector in detectors:
+                print(f" ~  Registered detector '{detector.name}'")
             print(f" ~  Successfully loaded command book '{self.name}'")
             return new_cb, module
         else:
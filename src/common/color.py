@@ -0,0 +1,101 @@
+"""Filters images down to the pixels that fall within a set of HSV color ranges."""
+
+import threading
+import cv2
+import numpy as np
+
+
+# Maps each set of ranges to the ColorFilter that applies it
+FILTERS = {}
+FILTERS_LOCK = threading.Lock()
+
+
+class ColorFilter:
+    """
+    Keeps only the pixels of an image that fall within any of a fixed set of HSV ranges.
+    The intermediate HSV image, the mask and the result are written into buffers that are
+    reused between calls, separately for each thread.
+    """
+
+    def __init__(self, ranges):
+        """
+        Creates a new ColorFilter.
+        :param ranges:  A list of tuples, each of which is a pair of lower and upper HSV bounds.
+        """
+
+        self.ranges = tuple((tuple(lower), tuple(upper)) for lower, upper in ranges)
+        self.buffers = threading.local()
+
+    def mask(self, image, hsv=None):
+        """
+        Returns a mask of the pixels in IMAGE that fall within any of this filter's ranges.
+        The mask is overwritten by the next call to this filter on the same thread.
+        :param image:   A BGR or BGRA image.
+        :param hsv:     IMAGE already converted to HSV, if the caller has it.
+        :return:        A single-channel mask that is 255 wherever a pixel is in range.
+        """
+
+        if hsv is None:
+            hsv = self._buffer('hsv', image.shape[:2] + (3,))
+            cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+        mask = self._buffer('mask', hsv.shape[:2])
+        cv2.inRange(hsv, self.ranges[0][0], self.ranges[0][1], dst=mask)
+        if len(self.ranges) > 1:
+            scratch = self._buffer('scratch', hsv.shape[:2])
+            for lower, upper in self.ranges[1:]:
+                cv2.inRange(hsv, lower, upper, dst=scratch)
+                cv2.bitwise_or(mask, scratch, dst=mask)
+        return mask
+
+    def apply(self, image, out=None):
+        """
+        Returns a copy of IMAGE in which every pixel outside of this filter's ranges is black.
+        :param image:   A BGR or BGRA image.
+        :param out:     The array to write the result into. If not provided, the result is
+                        overwritten by the next call to this filter on the same thread.
+        :return:        The filtered image.
+        """
+
+        if out is None:
+            out = self._buffer('result', image.shape)
+        out.fill(0)
+        cv2.copyTo(image, self.mask(image), out)
+        return out
+
+    def _buffer(self, name, shape):
+        """Returns this thread's reusable uint8 buffer NAME, reallocating it if SHAPE changed."""
+
+        buffer = getattr(self.buffers, name, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.uint8)
+            setattr(self.buffers, name, buffer)
+        return buffer
+
+
+def get_filter(ranges):
+    """Returns the shared ColorFilter for RANGES, creating it the first time it is needed."""
+
+    key = tuple((tuple(lower), tuple(upper)) for lower, upper in ranges)
+    color_filter = FILTERS.get(key)
+    if color_filter is None:
+        with FILTERS_LOCK:
+            color_filter = FILTERS.setdefault(key, ColorFilter(key))
+    return color_filter
+
+
+def filter_color(image, ranges):
+    """
+    Returns a filtered copy of IMAGE that only contains pixels within the given HSV RANGES.
+    :param image:   The image to filter.
+    :param ranges:  A list of tuples, each of which is a pair of lower and upper HSV bounds.
+    :return:        The filtered image, which must be copied if it needs to outlive the
+                    next call with the same RANGES on the same thread.
+    """
+
+    return get_filter(ranges).apply(image)
+
+
+def mask(image, ranges, hsv=None):
+    """Returns a new mask of the pixels in IMAGE that fall within any of the HSV RANGES."""
+
+    return get_filter(ranges).mask(image, hsv).copy()
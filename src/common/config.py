@@ -3,6 +3,9 @@
 這個檔案就像是程式的「共用筆記本」所有的模組 (機器人、介面、偵測器) 都會來這裡讀取或寫入資料。
 """
 
+from src.common.events import EventBus
+
+
 #########################
 #       常數設定        #
 #########################
@@ -15,6 +18,9 @@ RESOURCES_DIR = 'resources'  # 資源資料夾的名稱 (放腳本和指令書
 # 玩家目前在小地圖上的相對座標 (x, y)，範圍是 0 到 1
 player_pos = (0, 0)
 
+# 玩家目前的移動速度 (每秒移動多少相對座標)，由卡爾曼濾波器估計
+player_velocity = (0, 0)
+
 # 總開關：True 代表程式正在自動練功，False 代表暫停
 enabled = False
 
@@ -30,6 +36,9 @@ path = []
 #############################
 # 這裡儲存了程式的各個重要器官，方便大家互相呼叫
 
+# Bus: 模組之間的事件管道，例如通知機器人「輪出現了」，不用大家互相改對方的變數
+bus = EventBus()
+
 # Routine: 負責讀取並執行你的 .csv 腳本
 routine = None
 
@@ -42,6 +51,9 @@ bot = None
 # Capture: 機器人的眼睛，負責截圖和辨識小地圖
 capture = None
 
+# Notifier: 機器人的警報器，負責偵測輪、菁英王和其他玩家等事件
+notifier = None
+
 # Listener: 機器人的耳朵，負責監聽你有沒有按下 Insert 或 F6
 listener = None
 
@@ -0,0 +1,159 @@
+"""
+Typed events that modules publish to each other instead of writing to each other's state.
+Each subscriber receives its events through its own queue, so publishing never blocks and
+subscribers can react as soon as an event arrives instead of polling.
+"""
+
+import time
+import queue
+import threading
+
+
+#################################
+#            Events             #
+#################################
+class Event:
+    """The base class of every event. Subscribing to Event receives every event."""
+
+    def __init__(self):
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={v!r}' for k, v in self.__dict__.items() if k != 'timestamp')
+        return f'{type(self).__name__}({fields})'
+
+
+class RuneAppeared(Event):
+    """A rune appeared on the minimap."""
+
+    def __init__(self, pos, closest, points):
+        """
+        :param pos:         The rune's position, relative to the minimap.
+        :param closest:     The routine Point closest to the rune.
+        :param points:      The PointIndex that CLOSEST was found in.
+        """
+
+        super().__init__()
+        self.pos = pos
+        self.closest = closest
+        self.points = points
+
+
+class RuneExpired(Event):
+    """
+    The active rune should no longer be pursued, either because it went unsolved for too
+    long or because the bot was restarted.
+    """
+
+
+class PlayerEntered(Event):
+    """The number of other players on the minimap increased."""
+
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+
+class PlayerLeft(Event):
+    """The number of other players on the minimap decreased."""
+
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+
+class EliteBoss(Event):
+    """The Elite Boss's warning sign appeared."""
+
+
+class MapChanged(Event):
+    """The screen went black, which usually means that the player was moved to another map."""
+
+
+class PositionUpdated(Event):
+    """The player's position on the minimap was measured again."""
+
+    def __init__(self, pos, velocity, timestamp):
+        """
+        :param pos:         The filtered position, relative to the minimap.
+        :param velocity:    The estimated velocity in relative units per second.
+        :param timestamp:   The time at which the minimap was captured.
+        """
+
+        super().__init__()
+        self.pos = pos
+        self.velocity = velocity
+        self.timestamp = timestamp
+
+
+#################################
+#              Bus              #
+#################################
+class Subscription:
+    """A subscriber's queue of events."""
+
+    def __init__(self, types):
+        self.types = types
+        self.queue = queue.SimpleQueue()
+
+    def get(self, timeout=None):
+        """Blocks until the next event arrives and returns it, or None if TIMEOUT expired."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        """Returns every event that has arrived since the last call without blocking."""
+
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class EventBus:
+    """
+    Delivers published events to every Subscription for their type or any of its base
+    classes. The subscriber lists are replaced rather than modified, so publishing only
+    reads them and never needs to take a lock.
+    """
+
+    def __init__(self):
+        self.subscribers = {}       # Maps each event type to a tuple of Subscriptions
+        self.lock = threading.Lock()
+
+    def subscribe(self, *types):
+        """
+        Creates a new Subscription that receives every event of the given TYPES.
+        :param types:   The Event subclasses to receive.
+        :return:        The Subscription.
+        """
+
+        subscription = Subscription(types)
+        with self.lock:
+            subscribers = dict(self.subscribers)
+            for t in types:
+                subscribers[t] = subscribers.get(t, ()) + (subscription,)
+            self.subscribers = subscribers
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops delivering events to SUBSCRIPTION."""
+
+        with self.lock:
+            subscribers = dict(self.subscribers)
+            for t in subscription.types:
+                subscribers[t] = tuple(s for s in subscribers.get(t, ()) if s is not subscription)
+            self.subscribers = subscribers
+
+    def publish(self, event):
+        """Queues EVENT for every subscriber of its type without blocking."""
+
+        subscribers = self.subscribers
+        for t in type(event).__mro__:
+            for subscription in subscribers.get(t, ()):
+                subscription.queue.put(event)
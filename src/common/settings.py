@@ -70,18 +70,20 @@ SETTING_VALIDATORS = {
     'move_tolerance': float,
     'adjust_tolerance': float,
     'record_layout': validate_boolean,
-    'buff_cooldown': validate_nonnegative_int
+    'buff_cooldown': validate_nonnegative_int,
+    'input_latency': float
 }
 
 
 def reset():
     """Resets all settings to their default values."""
 
-    global move_tolerance, adjust_tolerance, record_layout, buff_cooldown
+    global move_tolerance, adjust_tolerance, record_layout, buff_cooldown, input_latency
     move_tolerance = 0.1
     adjust_tolerance = 0.01
     record_layout = False
     buff_cooldown = 180
+    input_latency = 0.05
 
 
 # The allowed error from the destination when moving towards a Point
@@ -96,4 +98,7 @@ record_layout = False
 # The amount of time (in seconds) to wait between each call to the 'buff' command
 buff_cooldown = 180
 
+# The amount of time (in seconds) between sending an input and the game reacting to it
+input_latency = 0.05
+
 reset()
@@ -1,11 +1,13 @@
 """A collection of functions and classes used across multiple modules."""
 
 import math
+import time
 import queue
 import cv2
 import threading
 import numpy as np
-from src.common import config, settings
+from src.common import color, config, settings
+from src.capture.tracking import MAX_MEASUREMENT_GAP
 from random import random
 
 
@@ -72,43 +74,65 @@ def separate_args(arguments):
     return args, kwargs
 
 
+def to_gray(image):
+    """Converts IMAGE to grayscale unless it already is."""
+
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
 def single_match(frame, template):
     """
-    Finds the best match within FRAME.
-    :param frame:       The image in which to search for TEMPLATE.
+    Finds the best match within FRAME. Kept for command books, new code should register
+    its templates with src.detection.matching instead.
+    :param frame:       The image in which to search for TEMPLATE, either in color or grayscale.
     :param template:    The template to match with.
     :return:            The top-left and bottom-right positions of the best match.
     """
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF)
-    _, _, _, top_left = cv2.minMaxLoc(result)
-    w, h = template.shape[::-1]
-    bottom_right = (top_left[0] + w, top_left[1] + h)
+    from src.detection import matching      # Imported here since matching depends on utils
+
+    template = matching.Template('', template, method=cv2.TM_CCOEFF)
+    x, y, _ = matching.best(frame, template)
+    top_left = (int(round(x - template.width / 2)), int(round(y - template.height / 2)))
+    bottom_right = (top_left[0] + template.width, top_left[1] + template.height)
     return top_left, bottom_right
 
 
 def multi_match(frame, template, threshold=0.95):
     """
-    Finds all matches in FRAME that are similar to TEMPLATE by at least THRESHOLD.
-    :param frame:       The image in which to search.
+    Finds all matches in FRAME that are similar to TEMPLATE by at least THRESHOLD. Kept for
+    command books, new code should register its templates with src.detection.matching instead.
+    :param frame:       The image in which to search, either in color or grayscale.
     :param template:    The template to match with.
     :param threshold:   The minimum percentage of TEMPLATE that each result must match.
     :return:            An array of matches that exceed THRESHOLD.
     """
 
-    if template.shape[0] > frame.shape[0] or template.shape[1] > frame.shape[1]:
-        return []
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
-    locations = np.where(result >= threshold)
-    locations = list(zip(*locations[::-1]))
-    results = []
-    for p in locations:
-        x = int(round(p[0] + template.shape[1] / 2))
-        y = int(round(p[1] + template.shape[0] / 2))
-        results.append((x, y))
-    return results
+    from src.detection import matching
+
+    matches = matching.match(frame, matching.Template('', template), threshold)
+    return [(int(round(x)), int(round(y))) for x, y, _ in matches]
+
+
+def predicted_player_pos(lead=None):
+    """
+    Extrapolates the player's position to the moment that an input sent now will take effect,
+    accounting for the time since the latest minimap was captured and the player's velocity.
+    :param lead:    How far into the future to predict, defaults to settings.input_latency.
+    :return:        The predicted position, or the last measured position if the player has
+                    not been measured recently enough to be predicted.
+    """
+
+    if lead is None:
+        lead = settings.input_latency
+    estimator = getattr(config.capture, 'estimator', None)
+    if estimator is not None:
+        predicted = estimator.predict(time.time() + lead, lead + MAX_MEASUREMENT_GAP)
+        if predicted is not None:
+            return predicted
+    return config.player_pos
 
 
 def convert_to_relative(point, frame):
@@ -150,16 +174,21 @@ def filter_color(img, ranges):
     :return:        A filtered copy of IMG.
     """
 
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, ranges[0][0], ranges[0][1])
-    for i in range(1, len(ranges)):
-        mask = cv2.bitwise_or(mask, cv2.inRange(hsv, ranges[i][0], ranges[i][1]))
+    return color.filter_color(img, ranges).copy()
+
+
+def dark_fraction(image, threshold=15, step=1):
+    """
+    Estimates the fraction of pixels in IMAGE that are darker than THRESHOLD in grayscale by
+    only looking at every STEP-th pixel along each axis.
+    :param image:       The BGR(A) image to check.
+    :param threshold:   The grayscale intensity below which a pixel counts as dark.
+    :param step:        The distance between sampled pixels, where 1 samples every pixel.
+    :return:            The fraction of sampled pixels that are dark, between 0 and 1.
+    """
 
-    # Mask the image
-    color_mask = mask > 0
-    result = np.zeros_like(img, np.uint8)
-    result[color_mask] = img[color_mask]
-    return result
+    sample = to_gray(np.ascontiguousarray(image[::step, ::step]))
+    return np.count_nonzero(sample < threshold) / sample.size
 
 
 def draw_location(minimap, pos, color):
@@ -1,26 +1,186 @@
 """
 [視覺辨識模組]
-這個模組負責使用 TensorFlow 和 OpenCV 來辨識畫面中的物件，
+這個模組負責使用 AI 模型和 OpenCV 來辨識畫面中的物件，
 特別是用來解決遊戲中的「輪」(Rune) 箭頭謎題。
 """
 
+import os
 import cv2
-import tensorflow as tf
+import threading
 import numpy as np
-from src.common import utils
+from concurrent.futures import Future
+from src.common import color, utils
+
+
+# 箭頭的顏色範圍 (橘色到綠色，HSV 色彩空間)
+ARROW_RANGES = (
+    ((1, 100, 100), (75, 255, 255)),
+)
+
+
+# 模型檔案的位置，ONNX 和 TFLite 版本由 src/detection/export.py 轉換產生
+MODEL_DIR = os.path.join('assets', 'models', 'rune_model_rnn_filtered_cannied')
+SAVED_MODEL_DIR = os.path.join(MODEL_DIR, 'saved_model')
+ONNX_PATH = os.path.join(MODEL_DIR, 'model.onnx')
+TFLITE_PATH = os.path.join(MODEL_DIR, 'model.tflite')
+
+# 推論時使用的 CPU 執行緒數量，None 代表使用執行環境的預設值
+INFERENCE_THREADS = None
+
+# 每個推論後端都會回傳的輸出
+OUTPUTS = ('detection_boxes', 'detection_scores', 'detection_classes', 'num_detections')
+
+# 載入模型後先試跑一次用的圖片大小，和 merge_detection 補黑邊後的大小相同
+SMOKE_TEST_SHAPE = (1, 384, 455, 3)
+
+
+#########################
+#       推論後端        #
+#########################
+class InferenceBackend:
+    """
+    執行輪模型的方式。不同的後端可以執行同一個模型的不同格式，
+    例如完整的 TensorFlow，或是比較輕量的 ONNX Runtime 和 TFLite。
+    """
+
+    name = None
+
+    def infer(self, batch):
+        """
+        對一批圖片執行推論。
+        :param batch:   形狀為 (數量, 高, 寬, 3) 的 uint8 陣列。
+        :return:        一個字典，OUTPUTS 裡的每個輸出都是第一維為批次的 Numpy 陣列。
+        """
+
+        raise NotImplementedError
+
+
+class TensorFlowBackend(InferenceBackend):
+    """用完整的 TensorFlow 執行原始的 SavedModel。"""
+
+    name = 'tensorflow'
+
+    def __init__(self, path=SAVED_MODEL_DIR, threads=INFERENCE_THREADS):
+        import tensorflow as tf     # 延遲匯入：TensorFlow 很大，只在真正需要模型時才載入
+
+        if threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+            except RuntimeError:
+                pass        # TensorFlow 已經初始化過了，沿用原本的設定
+        self.tf = tf
+        self.model = tf.saved_model.load(path)
+        self.function = self.model.signatures['serving_default']
+
+    def infer(self, batch):
+        output_dict = self.function(self.tf.convert_to_tensor(batch))
+        return {key: output_dict[key].numpy() for key in OUTPUTS}
+
+
+class OnnxBackend(InferenceBackend):
+    """用 ONNX Runtime 在 CPU 上執行轉換成 ONNX 格式的模型，不需要安裝 TensorFlow。"""
+
+    name = 'onnx'
+
+    def __init__(self, path=ONNX_PATH, threads=INFERENCE_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+    def infer(self, batch):
+        outputs = dict(zip(self.output_names, self.session.run(None, {self.input_name: batch})))
+        return {key: outputs[key] for key in OUTPUTS}
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    用 TFLite 直譯器執行轉換成 TFLite 格式的模型。
+    只有完全用 TFLite 內建運算轉換成功的模型，才能只靠 tflite_runtime 執行；
+    如果轉換時需要借用 TensorFlow 的運算 (SELECT_TF_OPS)，就一定要安裝完整的 TensorFlow。
+    """
+
+    name = 'tflite'
+
+    def __init__(self, path=TFLITE_PATH, threads=INFERENCE_THREADS):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=path, num_threads=threads)
+        self.runner = self.interpreter.get_signature_runner('serving_default')
+        self.input_name = next(iter(self.runner.get_input_details()))
+
+    def infer(self, batch):
+        outputs = self.runner(**{self.input_name: batch})
+        return {key: outputs[key] for key in OUTPUTS}
+
+
+# 每種後端對應的類別和模型檔案
+BACKENDS = {
+    'onnx': (OnnxBackend, ONNX_PATH),
+    'tflite': (TFLiteBackend, TFLITE_PATH),
+    'tensorflow': (TensorFlowBackend, SAVED_MODEL_DIR)
+}
 
 
 #########################
 #       功能函式        #
 #########################
-def load_model():
+def load_model(backend=None, threads=INFERENCE_THREADS):
+    """
+    載入輪模型。
+    :param backend:     要使用的後端名稱 ('onnx'、'tflite' 或 'tensorflow')。
+                        沒有指定的話，會優先使用已經轉換好、而且執行環境有安裝的輕量格式。
+    :param threads:     推論時使用的 CPU 執行緒數量。
+    :return:            載入好的 InferenceBackend。
+    """
+
+    if backend is not None:
+        cls, path = BACKENDS[backend]
+        return _smoke_test(cls(path, threads))
+    for name in ('onnx', 'tflite'):
+        cls, path = BACKENDS[name]
+        if os.path.exists(path):
+            # 執行環境缺少的不只是套件，也可能是模型用到的運算，所以試跑一次才算載入成功
+            try:
+                return _smoke_test(cls(path, threads))
+            except Exception as e:
+                print(f'\n[!] 無法使用 {name} 後端，改用下一個後端：{type(e).__name__}: {e}')
+    return _smoke_test(TensorFlowBackend(SAVED_MODEL_DIR, threads))
+
+
+def _smoke_test(model):
+    """讓 MODEL 推論一張全黑的圖片，確認它真的能執行，也順便讓第一次解輪不用等模型暖機。"""
+
+    model.infer(np.zeros(SMOKE_TEST_SHAPE, dtype=np.uint8))
+    return model
+
+
+def load_model_async(backend=None, threads=INFERENCE_THREADS):
     """
-    載入已儲存的 AI 模型權重到 Tensorflow 模型中。
-    :return:    Tensorflow 模型物件。
+    在背景執行緒載入模型，不會卡住呼叫的人。參數和 load_model 相同。
+    :return:    一個 Future，需要用到模型時呼叫 result() 等待它載入完成。
     """
 
-    model_dir = f'assets/models/rune_model_rnn_filtered_cannied/saved_model'
-    return tf.saved_model.load(model_dir)
+    future = Future()
+
+    def load():
+        try:
+            future.set_result(load_model(backend, threads))
+        except Exception as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+    return future
 
 
 def canny(image):
@@ -44,50 +204,36 @@ def filter_color(image):
     :return:        過濾顏色後的圖片。
     """
 
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, (1, 100, 100), (75, 255, 255))
-
-    # 遮罩圖片 (只保留符合顏色的部分)
-    color_mask = mask > 0
-    arrows = np.zeros_like(image, np.uint8)
-    arrows[color_mask] = image[color_mask]
-    return arrows
+    return color.filter_color(image, ARROW_RANGES)
 
 
 def run_inference_for_single_image(model, image):
     """
     對單張圖片執行一次推論 (Inference)。
     也就是讓 AI 看這張圖，然後猜它是什麼。
-    :param model:   要使用的模型物件。
+    :param model:   要使用的 InferenceBackend。
     :param image:   輸入的圖片。
     :return:        模型的預測結果，包含邊界框 (bounding boxes) 和類別 (classes)。
     """
 
-    image = np.asarray(image)
-
-    input_tensor = tf.convert_to_tensor(image)
-    input_tensor = input_tensor[tf.newaxis,...]
-
-    model_fn = model.signatures['serving_default']
-    output_dict = model_fn(input_tensor)
+    # 輪模型的輸入固定只能放一張圖片，所以每張圖片都要各自呼叫一次模型
+    output_dict = model.infer(np.asarray(image)[np.newaxis, ...])
 
-    num_detections = int(output_dict.pop('num_detections'))
-    output_dict = {key: value[0,:num_detections].numpy() 
+    num_detections = int(np.asarray(output_dict.pop('num_detections'))[0])
+    output_dict = {key: np.asarray(value[0, :num_detections])
                    for key, value in output_dict.items()}
     output_dict['num_detections'] = num_detections
     output_dict['detection_classes'] = output_dict['detection_classes'].astype(np.int64)
     return output_dict
 
 
-def sort_by_confidence(model, image):
+def top_detections(output_dict):
     """
-    對圖片執行一次推論，並回傳信心度最高的四個分類結果。
-    :param model:   要使用的模型物件。
-    :param image:   輸入的圖片。
-    :return:        模型的前四名預測結果。
+    從一次推論的結果中，取出信心度最高的四個分類結果。
+    :param output_dict: run_inference_for_single_image 的回傳值。
+    :return:            最多四個 (信心度, 邊界框, 類別)。
     """
 
-    output_dict = run_inference_for_single_image(model, image)
     zipped = list(zip(output_dict['detection_scores'],
                       output_dict['detection_boxes'],
                       output_dict['detection_classes']))
@@ -100,6 +246,17 @@ def sort_by_confidence(model, image):
     return result
 
 
+def sort_by_confidence(model, image):
+    """
+    對圖片執行一次推論，並回傳信心度最高的四個分類結果。
+    :param model:   要使用的模型物件。
+    :param image:   輸入的圖片。
+    :return:        模型的前四名預測結果。
+    """
+
+    return top_detections(run_inference_for_single_image(model, image))
+
+
 def get_boxes(model, image):
     """
     回傳前四個被分類出的箭頭的邊界框 (Bounding Boxes)。
@@ -109,13 +266,7 @@ def get_boxes(model, image):
     :return:        最多四個邊界框。
     """
 
-    output_dict = run_inference_for_single_image(model, image)
-    zipped = list(zip(output_dict['detection_scores'],
-                      output_dict['detection_boxes'],
-                      output_dict['detection_classes']))
-    pruned = [t for t in zipped if t[0] > 0.5]
-    pruned.sort(key=lambda x: x[0], reverse=True)
-    pruned = pruned[:4]
+    pruned = sort_by_confidence(model, image)
     boxes = [t[1:] for t in pruned]
     return boxes
 
@@ -132,6 +283,18 @@ def merge_detection(model, image):
     :return:        一個包含四個箭頭方向字串的清單。
     """
 
+    return [direction for direction, _ in classify_arrows(model, image)]
+
+
+def classify_arrows(model, image):
+    """
+    和 merge_detection 一樣辨識輪的箭頭，但同時回傳每個箭頭的信心度，
+    讓呼叫的人可以綜合多張畫面的結果。
+    :param model:   要使用的模型物件。
+    :param image:   輸入的圖片。
+    :return:        由左到右每個箭頭的 (方向, 信心度)。
+    """
+
     label_map = {1: 'up', 2: 'down', 3: 'left', 4: 'right'}
     converter = {'up': 'right', 'down': 'left'}         # 用於轉換「旋轉後的推論結果」
     classes = []
@@ -167,26 +330,29 @@ def merge_detection(model, image):
         if x_offset > 0 and y_offset > 0:
             preprocessed[y_offset:y_offset+height, x_offset:x_offset+width] = rune_box
 
-        # 對前處理後的圖片執行偵測
-        lst = sort_by_confidence(model, preprocessed)
+        # 對原本的圖片和旋轉後的圖片各執行一次偵測
+        rotated = cv2.rotate(preprocessed, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        upright_dict = run_inference_for_single_image(model, preprocessed)
+        rotated_dict = run_inference_for_single_image(model, rotated)
+
         # 依照 X 座標排序 (從左到右讀取箭頭)
+        lst = top_detections(upright_dict)
         lst.sort(key=lambda x: x[1][1])
-        classes = [label_map[item[2]] for item in lst]
+        classes = [(label_map[item[2]], float(item[0])) for item in lst]
 
-        # 對旋轉後的圖片執行偵測
-        rotated = cv2.rotate(preprocessed, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        lst = sort_by_confidence(model, rotated)
+        # 旋轉後圖片的偵測結果
+        lst = top_detections(rotated_dict)
         # 依照 X 座標排序 (注意：這裡的座標因為旋轉過所以不同)
         lst.sort(key=lambda x: x[1][2], reverse=True)
         # 只取旋轉後辨識為 上(1) 或 下(2) 的結果，並轉換回原本的 右 或 左
-        rotated_classes = [converter[label_map[item[2]]]
+        rotated_classes = [(converter[label_map[item[2]]], float(item[0]))
                            for item in lst
                            if item[2] in [1, 2]]
             
         # 合併兩次偵測的結果
         for i in range(len(classes)):
             # 如果原本辨識為 左 或 右，嘗試用旋轉後的結果替換 (因為模型對垂直箭頭辨識較準)
-            if rotated_classes and classes[i] in ['left', 'right']:
+            if rotated_classes and classes[i][0] in ['left', 'right']:
                 classes[i] = rotated_classes.pop(0)
 
     return classes
@@ -0,0 +1,151 @@
+"""
+Detectors are small, independent checks that the Notifier runs against captured frames.
+Each one declares how often it wants to run and how much time it needs, and a scheduler
+decides which of them to run on each frame.
+"""
+
+import time
+import threading
+from src.capture.motion import RegionWatcher
+
+
+# The minimum number of seconds between each report about the same detector
+REPORT_INTERVAL = 10
+
+
+class Detector:
+    """
+    The base class of every detector. Subclasses override DETECT and, optionally, REGION.
+    Any subclass defined in a command book is automatically run while that command book
+    is loaded.
+    """
+
+    name = None             # Shown in reports, defaults to the name of the class
+    source = 'frame'        # Either 'frame' for full-window frames or 'minimap'
+    frequency = 1           # The maximum number of times to run per second
+    max_staleness = 1       # The maximum number of seconds between runs
+    priority = 0            # Detectors with a higher priority run first
+    budget = 0.005          # The number of seconds that one run is expected to take
+    scale = 8               # How much to downscale frames by when checking the region for
+                            # changes, or None to run regardless of whether anything changed
+
+    def __init__(self):
+        if self.name is None:
+            self.name = type(self).__name__
+        self.watcher = None
+        if self.scale is not None:
+            self.watcher = RegionWatcher(max_staleness=self.max_staleness, scale=self.scale)
+        self.last_run = 0
+        self.last_report = 0
+        self.runs = 0
+        self.missed = 0
+        self.overruns = 0
+
+    def region(self, frame):
+        """
+        Returns the (left, top, right, bottom) area of FRAME that this detector looks at,
+        or None if it looks at the entire frame.
+        """
+
+        return None
+
+    def detect(self, frame):
+        """
+        Looks for this detector's event within FRAME and reacts to it.
+        :param frame:   The newest Frame from this detector's source.
+        :return:        None
+        """
+
+        raise NotImplementedError
+
+
+class DetectorScheduler:
+    """
+    Runs registered detectors on each new frame. Only detectors that are due are run, in
+    order of priority, and lower priority detectors are deferred to later frames once the
+    time spent on the current frame exceeds FRAME_BUDGET. Detectors that are deferred past
+    their maximum staleness run regardless, and are reported as having missed their deadline.
+    """
+
+    def __init__(self, frame_budget=0.025, slack=0.25):
+        """
+        Creates a new DetectorScheduler.
+        :param frame_budget:    The number of seconds to spend running detectors per frame.
+        :param slack:           How many seconds past its maximum staleness a detector may
+                                run before it counts as a missed deadline.
+        """
+
+        self.frame_budget = frame_budget
+        self.slack = slack
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def register(self, detector, group='default'):
+        """Adds DETECTOR to GROUP, a name that the detector can later be removed by."""
+
+        with self.lock:
+            self.groups.setdefault(group, []).append(detector)
+
+    def replace(self, group, detectors):
+        """Removes every detector in GROUP and replaces them with DETECTORS."""
+
+        with self.lock:
+            self.groups[group] = list(detectors)
+
+    def detectors(self):
+        """Returns every registered detector, sorted by descending priority."""
+
+        with self.lock:
+            detectors = [d for group in self.groups.values() for d in group]
+        return sorted(detectors, key=lambda d: -d.priority)
+
+    def frame_rate(self, source='frame'):
+        """Returns the highest frequency requested by any detector of SOURCE."""
+
+        return max((d.frequency for d in self.detectors() if d.source == source), default=0)
+
+    def run(self, frames):
+        """
+        Runs every detector that is due.
+        :param frames:  A dictionary mapping each source to its newest Frame.
+        :return:        None
+        """
+
+        start = time.time()
+        spent = 0
+        for detector in self.detectors():
+            # Frames arrive with some jitter, so allow detectors to run slightly early
+            frame = frames.get(detector.source)
+            if frame is None or frame.timestamp - detector.last_run < 0.9 / detector.frequency:
+                continue
+            late = frame.timestamp - detector.last_run - detector.max_staleness
+            overdue = late > 0
+            if spent + detector.budget > self.frame_budget and spent > 0 and not overdue:
+                continue
+            if detector.watcher is not None \
+                    and not detector.watcher.check(frame, detector.region(frame)):
+                continue
+
+            if detector.last_run > 0 and late > self.slack:
+                detector.missed += 1
+                self._report(detector, f'missed its deadline by {late:.2f} seconds')
+            detector.last_run = frame.timestamp
+            detector.runs += 1
+            began = time.time()
+            try:
+                detector.detect(frame)
+            except Exception as e:
+                self._report(detector, f'failed with {type(e).__name__}: {e}')
+            elapsed = time.time() - began
+            spent = time.time() - start
+            if elapsed > detector.budget:
+                detector.overruns += 1
+                self._report(detector, f'took {elapsed * 1000:.1f} ms, '
+                                       f'over its budget of {detector.budget * 1000:.1f} ms')
+
+    @staticmethod
+    def _report(detector, message):
+        now = time.time()
+        if now - detector.last_report > REPORT_INTERVAL:
+            detector.last_report = now
+            print(f"\n[!] Detector '{detector.name}' {message}")
@@ -0,0 +1,190 @@
+"""
+Converts the rune model's SavedModel into formats that lighter runtimes can execute, and
+checks that the converted model gives the same raw detections as the original.
+
+    python -m src.detection.export onnx --verify path/to/recording
+    python -m src.detection.export tflite --verify path/to/recording
+
+Recordings are anything that ReplayBackend can play back, such as a directory of screenshots
+taken while a rune was being solved. Converting to ONNX requires tf2onnx, and both conversions
+require TensorFlow. Once a model has been exported, the bot uses it automatically if its
+runtime is installed and it passes a test inference. The same comparison also runs as part
+of the test suite, see tests/test_export.py.
+"""
+
+import sys
+import time
+import argparse
+import subprocess
+import numpy as np
+from src.detection import detection
+
+
+# The number of highest scoring raw detections to compare in each image
+TOP_K = 10
+
+# Detections scoring less than this are only compared by score, since their boxes and
+# classes are noise that can legitimately differ between runtimes
+MIN_COMPARED_SCORE = 0.1
+
+# The maximum difference allowed between the original and converted model's outputs
+SCORE_TOLERANCE = 0.02
+BOX_TOLERANCE = 0.01
+
+
+def export_onnx(path=detection.ONNX_PATH, opset=13):
+    """Converts the SavedModel to ONNX using tf2onnx's command line converter."""
+
+    subprocess.run([sys.executable, '-m', 'tf2onnx.convert',
+                    '--saved-model', detection.SAVED_MODEL_DIR,
+                    '--output', path,
+                    '--opset', str(opset)], check=True)
+
+
+def export_tflite(path=detection.TFLITE_PATH):
+    """
+    Converts the SavedModel to TFLite, using only TFLite's built-in operations if possible so
+    that the model can run on tflite_runtime alone. Otherwise, the operations that TFLite does
+    not implement fall back to TensorFlow's kernels, and running the model requires TensorFlow.
+    """
+
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(detection.SAVED_MODEL_DIR)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+    try:
+        model = converter.convert()
+    except Exception as e:
+        print(f'[!] Could not convert with built-in operations only ({type(e).__name__}), '
+              f'the exported model will require TensorFlow to run')
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS,
+                                               tf.lite.OpsSet.SELECT_TF_OPS]
+        model = converter.convert()
+    with open(path, 'wb') as file:
+        file.write(model)
+
+
+def sample_images(recording, step=1):
+    """
+    Returns every STEP-th frame of RECORDING, preprocessed the same way as MERGE_DETECTION
+    prepares the image for its first inference.
+    """
+
+    from src.capture.backends import ReplayBackend
+
+    backend = ReplayBackend(recording, realtime=False)
+    images = []
+    i = 0
+    with backend:
+        while not backend.finished:
+            if i % step == 0:
+                image = backend.frame
+                height, width = image.shape[:2]
+                cropped = image[120:height//2, width//4:3*width//4]
+                images.append(detection.canny(detection.filter_color(cropped)))
+            i += 1
+            backend.advance()
+    return images
+
+
+def raw_detections(model, image, k=TOP_K):
+    """
+    Returns the K highest scoring detections in IMAGE before any score threshold is applied.
+    :return:    Rows of (score, class, ymin, xmin, ymax, xmax) sorted by descending score.
+    """
+
+    output_dict = detection.run_inference_for_single_image(model, image)
+    rows = np.column_stack((output_dict['detection_scores'],
+                            output_dict['detection_classes'],
+                            output_dict['detection_boxes']))
+    return rows[np.argsort(-rows[:, 0], kind='stable')[:k]]
+
+
+def compare(expected, actual):
+    """
+    Returns a description of the first difference between two sets of raw detections, or None
+    if they agree within tolerance. Detections whose scores are too close to tell apart may be
+    listed in either order, so each expected detection is matched to any equivalent one.
+    """
+
+    if len(expected) != len(actual):
+        return f'{len(expected)} detections became {len(actual)}'
+    difference = np.max(np.abs(expected[:, 0] - actual[:, 0]), initial=0)
+    if difference > SCORE_TOLERANCE:
+        return f'scores differ by up to {difference:.3f}'
+    unmatched = list(actual)
+    for row in expected[expected[:, 0] >= MIN_COMPARED_SCORE]:
+        for j, candidate in enumerate(unmatched):
+            if candidate[1] == row[1] \
+                    and abs(candidate[0] - row[0]) <= SCORE_TOLERANCE \
+                    and np.max(np.abs(candidate[2:] - row[2:])) <= BOX_TOLERANCE:
+                del unmatched[j]
+                break
+        else:
+            return f'no match for class {int(row[1])} at {np.round(row[2:], 3)} ' \
+                   f'with score {row[0]:.3f}'
+    return None
+
+
+def timed_load(backend, threads):
+    start = time.time()
+    model = detection.load_model(backend, threads)
+    print(f'[~] Loaded {backend} backend in {time.time() - start:.2f} seconds')
+    return model
+
+
+def verify(backend, images, threads=detection.INFERENCE_THREADS):
+    """
+    Runs the original and converted models on IMAGES and reports any image on which their raw
+    detections differ, along with how long each model took.
+    :return:    A list of (image index, difference) for every image that did not match, and
+                the number of images in which the original model found an arrow.
+    """
+
+    reference = timed_load('tensorflow', threads)
+    converted = timed_load(backend, threads)
+    mismatches = []
+    confident = 0
+    durations = {'tensorflow': 0, backend: 0}
+    for i, image in enumerate(images):
+        results = {}
+        for name, model in (('tensorflow', reference), (backend, converted)):
+            start = time.time()
+            results[name] = raw_detections(model, image)
+            durations[name] += time.time() - start
+        confident += bool(np.any(results['tensorflow'][:, 0] > 0.5))
+        difference = compare(results['tensorflow'], results[backend])
+        if difference is not None:
+            mismatches.append((i, difference))
+            print(f'[!] Image {i}: {difference}')
+    for name, duration in durations.items():
+        print(f' -  {name}: {duration / max(1, len(images)) * 1000:.1f} ms per image')
+    print(f'[~] {len(images) - len(mismatches)} of {len(images)} images matched, '
+          f'{confident} of which contained arrows')
+    return mismatches, confident
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the rune model for a lighter runtime.')
+    parser.add_argument('backend', choices=('onnx', 'tflite'))
+    parser.add_argument('--verify', metavar='RECORDING',
+                        help='compare the exported model against the SavedModel on a recording')
+    parser.add_argument('--step', type=int, default=1,
+                        help='only verify with every STEP-th frame of the recording')
+    parser.add_argument('--threads', type=int, default=detection.INFERENCE_THREADS,
+                        help='the number of CPU threads to run inference with')
+    parser.add_argument('--skip-export', action='store_true',
+                        help='only verify a model that was already exported')
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        if args.backend == 'onnx':
+            export_onnx()
+        else:
+            export_tflite()
+        print(f'[~] Exported {args.backend} model to {detection.BACKENDS[args.backend][1]}')
+    if args.verify:
+        mismatches, confident = verify(args.backend, sample_images(args.verify, args.step),
+                                       args.threads)
+        if mismatches or confident == 0:
+            sys.exit(1)
@@ -0,0 +1,305 @@
+"""
+A template matching engine. Templates are registered once with all of their preprocessing
+done up front, and matches are returned as compact arrays with duplicate hits suppressed.
+"""
+
+import cv2
+import numpy as np
+from src.common import color, utils
+from src.capture.frames import Frame
+
+
+# Maps the name of each registered template to its Template object
+TEMPLATES = {}
+
+# Color-filtered searches with more blobs than this fall back to matching the entire image
+MAX_BLOBS = 16
+
+
+class Template:
+    """A preprocessed template image along with the settings used to match it."""
+
+    def __init__(self, name, image, ranges=None, mask=None, threshold=0.9,
+                 method=cv2.TM_CCOEFF_NORMED, pyramid=0, candidates=5):
+        """
+        Creates a new Template.
+        :param name:        A unique name for this template.
+        :param image:       The template image, either in color or grayscale.
+        :param ranges:      If provided, both this template and every image it is matched
+                            against are first filtered to only contain these HSV ranges.
+                            Matching is then only done around blobs of pixels in these ranges.
+        :param mask:        An optional mask of the template pixels to compare.
+        :param threshold:   The default minimum score of a match.
+        :param method:      The OpenCV template matching method, higher scores must be better.
+        :param pyramid:     If greater than 0, searches are first run on images downscaled by
+                            a factor of 2 this many times, and then refined at full resolution
+                            only around the best coarse candidates.
+        :param candidates:  The number of coarse candidates to refine when using a pyramid.
+        """
+
+        if ranges is not None:
+            image = color.filter_color(image, ranges)
+        self.name = name
+        self.image = utils.to_gray(image)
+        self.ranges = ranges
+        self.mask = mask
+        self.threshold = threshold
+        self.method = method
+        self.height, self.width = self.image.shape
+
+        self.pyramid = pyramid
+        self.candidates = candidates
+        self.coarse_image = downscale(self.image, pyramid)
+        self.coarse_mask = None
+        if mask is not None and pyramid > 0:
+            size = self.coarse_image.shape[::-1]
+            self.coarse_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+
+
+def register(name, image, **kwargs):
+    """
+    Preprocesses IMAGE and registers it under NAME. Accepts the same keyword arguments as Template.
+    :return:    The registered Template.
+    """
+
+    template = Template(name, image, **kwargs)
+    TEMPLATES[name] = template
+    return template
+
+
+def get(template):
+    """Returns TEMPLATE if it is a Template, otherwise the registered Template named TEMPLATE."""
+
+    if isinstance(template, Template):
+        return template
+    return TEMPLATES[template]
+
+
+def prepare(frame, template, region=None):
+    """
+    Converts FRAME into the form that TEMPLATE is matched against, reusing the conversions
+    cached on FRAME if it is a captured Frame.
+    :param frame:       A Frame or an image in color or grayscale.
+    :param template:    The Template that will be matched.
+    :param region:      An optional (left, top, right, bottom) area of FRAME to keep.
+    :return:            The prepared grayscale image.
+    """
+
+    if isinstance(frame, Frame):
+        image = frame.filtered_gray(template.ranges) if template.ranges else frame.gray()
+    elif template.ranges:
+        image = utils.to_gray(color.filter_color(frame, template.ranges))
+    else:
+        image = utils.to_gray(frame)
+    if region is not None:
+        left, top, right, bottom = region
+        image = image[top:bottom, left:right]
+    return image
+
+
+def match(frame, template, threshold=None, region=None):
+    """
+    Finds every distinct occurrence of TEMPLATE within FRAME. Of any matches closer together
+    than the size of TEMPLATE, only the one with the highest score is kept.
+    :param frame:       A Frame or an image in color or grayscale.
+    :param template:    A Template or the name of a registered one.
+    :param threshold:   The minimum score of a match, defaults to the template's own threshold.
+    :param region:      An optional (left, top, right, bottom) area of FRAME to search.
+    :return:            An array of rows (x, y, score) sorted by descending score, where
+                        (x, y) is the center of each match within FRAME.
+    """
+
+    template = get(template)
+    if threshold is None:
+        threshold = template.threshold
+
+    # Only filtered templates can match where there is color, so check that before
+    # converting FRAME, which is far cheaper when none of it is in range
+    mask = None
+    if template.ranges:
+        mask = color_mask(frame, template.ranges, region)
+        if cv2.countNonZero(mask) == 0:
+            return np.empty((0, 3), dtype=np.float32)
+
+    image = prepare(frame, template, region)
+    if template.height > image.shape[0] or template.width > image.shape[1]:
+        return np.empty((0, 3), dtype=np.float32)
+
+    if mask is not None:
+        matches = _match_blobs(image, template, mask, threshold)
+        if matches is not None:
+            return _to_region(matches, region)
+    if template.pyramid > 0:
+        return _to_region(_refine(image, template, frame, region, threshold), region)
+    result = cv2.matchTemplate(image, template.image, template.method, mask=template.mask)
+    locations = suppress(result, threshold, template.height, template.width)
+    return _to_region(_to_matches(result, locations, template), region)
+
+
+def best(frame, template, region=None):
+    """
+    Finds the single best match of TEMPLATE within FRAME regardless of its score.
+    :return:    A row (x, y, score) where (x, y) is the center of the match within FRAME.
+    """
+
+    template = get(template)
+    image = prepare(frame, template, region)
+    if template.height > image.shape[0] or template.width > image.shape[1]:
+        return np.array((0, 0, -np.inf), dtype=np.float32)
+
+    if template.pyramid > 0:
+        matches = _refine(image, template, frame, region, None)
+    else:
+        result = cv2.matchTemplate(image, template.image, template.method, mask=template.mask)
+        _, _, _, (x, y) = cv2.minMaxLoc(result)
+        matches = _to_matches(result, (np.array([y]), np.array([x])), template)
+    if len(matches) == 0:
+        return np.array((0, 0, -np.inf), dtype=np.float32)
+    return _to_region(matches, region)[0]
+
+
+def color_mask(frame, ranges, region=None):
+    """
+    Returns a mask of the pixels in REGION of FRAME that fall within any of the HSV RANGES,
+    reusing the mask cached on FRAME if it is a captured Frame.
+    """
+
+    if isinstance(frame, Frame):
+        mask = frame.mask(ranges)
+    else:
+        mask = color.get_filter(ranges).mask(frame)
+    if region is not None:
+        left, top, right, bottom = region
+        mask = mask[top:bottom, left:right]
+    return mask
+
+
+def suppress(result, threshold, height, width):
+    """
+    Applies non-maximum suppression to a template matching RESULT. A location is kept only
+    if it exceeds THRESHOLD and is the maximum within a HEIGHT by WIDTH window around it.
+    :return:    The row and column indices of the remaining locations.
+    """
+
+    kernel = np.ones((height, width), dtype=np.uint8)
+    peaks = (result >= threshold) & (result >= cv2.dilate(result, kernel))
+    return np.nonzero(peaks)
+
+
+def downscale(image, levels):
+    """Halves the width and height of IMAGE LEVELS times."""
+
+    for _ in range(levels):
+        image = cv2.pyrDown(image)
+    return image
+
+
+def _refine(image, template, frame, region, threshold):
+    """
+    Runs a coarse-to-fine search for TEMPLATE within IMAGE. If THRESHOLD is None, returns the
+    refined candidates regardless of their scores instead of every match that exceeds it.
+    """
+
+    # Find the best candidates on the downscaled image
+    if isinstance(frame, Frame) and region is None:
+        key = ('pyramid', template.ranges, template.pyramid)
+        coarse = frame.derive(key, lambda f: downscale(image, template.pyramid))
+    else:
+        coarse = downscale(image, template.pyramid)
+    c_height, c_width = template.coarse_image.shape
+    if c_height > coarse.shape[0] or c_width > coarse.shape[1]:
+        return np.empty((0, 3), dtype=np.float32)
+    result = cv2.matchTemplate(coarse, template.coarse_image, template.method,
+                               mask=template.coarse_mask)
+    ys, xs = suppress(result, -np.inf, c_height, c_width)
+    candidates = np.argsort(-result[ys, xs], kind='stable')[:template.candidates]
+
+    # Search at full resolution only within a small window around each candidate
+    scale = 2 ** template.pyramid
+    pad = 2 * scale
+    refined = []
+    seen = set()
+    for y, x in zip(ys[candidates] * scale, xs[candidates] * scale):
+        left, top = max(0, x - pad), max(0, y - pad)
+        window = image[top:y + template.height + pad, left:x + template.width + pad]
+        if template.height > window.shape[0] or template.width > window.shape[1]:
+            continue
+        result = cv2.matchTemplate(window, template.image, template.method, mask=template.mask)
+        if threshold is None:
+            _, _, _, (w_x, w_y) = cv2.minMaxLoc(result)
+            locations = (np.array([w_y]), np.array([w_x]))
+        else:
+            locations = suppress(result, threshold, template.height, template.width)
+        for match in _to_matches(result, locations, template):
+            match[0] += left
+            match[1] += top
+            if (match[0], match[1]) not in seen:
+                seen.add((match[0], match[1]))
+                refined.append(match)
+
+    if not refined:
+        return np.empty((0, 3), dtype=np.float32)
+    matches = np.array(refined, dtype=np.float32)
+    return matches[np.argsort(-matches[:, 2], kind='stable')]
+
+
+def _match_blobs(image, template, mask, threshold):
+    """
+    Matches TEMPLATE only within the windows of IMAGE that overlap a connected blob of MASK.
+    Since every other pixel of IMAGE has been filtered to black, no match can occur elsewhere.
+    :return:    The matches, or None if MASK has too many blobs for this to be worthwhile.
+    """
+
+    if cv2.countNonZero(mask) == 0:
+        return np.empty((0, 3), dtype=np.float32)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if count - 1 > MAX_BLOBS:
+        return None
+
+    found = []
+    seen = set()
+    for x, y, width, height, _ in stats[1:]:
+        left = max(0, x - template.width + 1)
+        top = max(0, y - template.height + 1)
+        right = min(image.shape[1], x + width + template.width - 1)
+        bottom = min(image.shape[0], y + height + template.height - 1)
+        window = image[top:bottom, left:right]
+        if template.height > window.shape[0] or template.width > window.shape[1]:
+            continue
+        result = cv2.matchTemplate(window, template.image, template.method, mask=template.mask)
+        locations = suppress(result, threshold, template.height, template.width)
+        for match in _to_matches(result, locations, template):
+            match[0] += left
+            match[1] += top
+            if (match[0], match[1]) not in seen:
+                seen.add((match[0], match[1]))
+                found.append(match)
+
+    # Blobs that are close together yield overlapping windows, so suppress duplicate matches
+    found.sort(key=lambda m: -m[2])
+    matches = []
+    for match in found:
+        if all(abs(match[0] - m[0]) >= template.width or abs(match[1] - m[1]) >= template.height
+               for m in matches):
+            matches.append(match)
+    return np.array(matches, dtype=np.float32).reshape(-1, 3)
+
+
+def _to_matches(result, locations, template):
+    ys, xs = locations
+    scores = result[ys, xs]
+    order = np.argsort(-scores, kind='stable')
+    matches = np.empty((len(order), 3), dtype=np.float32)
+    matches[:, 0] = xs[order] + template.width / 2
+    matches[:, 1] = ys[order] + template.height / 2
+    matches[:, 2] = scores[order]
+    return matches
+
+
+def _to_region(matches, region):
+    """Offsets MATCHES found within REGION so that they are relative to the entire frame."""
+
+    if region is not None:
+        matches[:, 0] += region[0]
+        matches[:, 1] += region[1]
+    return matches
@@ -0,0 +1,153 @@
+"""
+Solves the rune's arrow-key puzzle by combining detections across consecutive frames.
+A worker classifies each newly captured frame and adds its arrows to a score-weighted
+vote, stopping as soon as every arrow has a clear winner.
+"""
+
+import time
+import threading
+from functools import partial
+from collections import defaultdict
+from concurrent.futures import Future
+from src.common import config
+from src.detection import detection
+from src.detection.worker import InferenceWorker
+
+
+# How far each arrow's leading direction must be ahead of the runner-up, in summed detection
+# scores. One frame contributes at most 1 per arrow, so at least two frames must agree.
+CONFIDENCE_THRESHOLD = 1.5
+
+# The maximum number of frames to classify before giving up
+MAX_FRAMES = 15
+
+# The maximum number of seconds to spend before giving up
+TIMEOUT = 10
+
+
+class ArrowVotes:
+    """Accumulates score-weighted votes for the direction of each of the rune's arrows."""
+
+    def __init__(self, count=4):
+        """
+        Creates a new ArrowVotes.
+        :param count:   The number of arrows in the puzzle.
+        """
+
+        self.votes = [defaultdict(float) for _ in range(count)]
+        self.frames = 0
+
+    def add(self, arrows):
+        """
+        Adds one frame's classification to the vote. Frames in which the wrong number of
+        arrows was found cannot be lined up with the others, so they are ignored.
+        :param arrows:  A (direction, score) tuple for each arrow, from left to right.
+        :return:        Whether ARROWS was counted.
+        """
+
+        if len(arrows) != len(self.votes):
+            return False
+        for votes, (direction, score) in zip(self.votes, arrows):
+            votes[direction] += score
+        self.frames += 1
+        return True
+
+    def solution(self):
+        """Returns the leading direction of each arrow, or an empty list if nothing was counted."""
+
+        if self.frames == 0:
+            return []
+        return [max(votes, key=votes.get) for votes in self.votes]
+
+    def confidence(self):
+        """Returns the smallest lead that any arrow's leading direction has over its runner-up."""
+
+        if self.frames == 0:
+            return 0
+        leads = []
+        for votes in self.votes:
+            weights = sorted(votes.values(), reverse=True) + [0]
+            leads.append(weights[0] - weights[1])
+        return min(leads)
+
+
+class RuneSolver:
+    """
+    Classifies new frames on a worker thread until the votes are confident enough. Only
+    frames captured after the solver starts are used, and none is classified twice.
+    """
+
+    def __init__(self, model, threshold=CONFIDENCE_THRESHOLD, max_frames=MAX_FRAMES,
+                 timeout=TIMEOUT):
+        """
+        Creates a new RuneSolver.
+        :param model:       The InferenceBackend or InferenceWorker to classify arrows with.
+        :param threshold:   The confidence at which to accept the current solution.
+        :param max_frames:  The maximum number of frames to classify.
+        :param timeout:     The maximum number of seconds to spend.
+        """
+
+        if isinstance(model, InferenceWorker):
+            self.classify = model.classify_arrows
+        else:
+            self.classify = partial(detection.classify_arrows, model)
+        self.threshold = threshold
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.votes = ArrowVotes()
+        self.stopped = False
+
+    def start(self, capture):
+        """
+        Starts classifying frames from CAPTURE in the background.
+        :param capture:     The Capture to take frames from.
+        :return:            A Future that resolves to the solution, or an empty list if
+                            the votes never became confident enough.
+        """
+
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._main(capture))
+            except Exception as e:
+                future.set_exception(e)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def solve(self, capture):
+        """Classifies frames from CAPTURE and blocks until a solution is found or given up on."""
+
+        return self.start(capture).result()
+
+    def stop(self):
+        """Makes the worker give up after the frame it is currently classifying."""
+
+        self.stopped = True
+
+    def _main(self, capture):
+        deadline = time.time() + self.timeout
+        last_seq = capture.frames.seq       # Frames from before the puzzle opened are stale
+        frames = 0
+        while frames < self.max_frames and not self.stopped and config.enabled:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # Classifying can take longer than the frame buffer takes to wrap around
+            latest = capture.wait_for_frame(last_seq, timeout=min(remaining, 1), pin=True)
+            if latest is None:
+                continue
+            try:
+                last_seq = latest.seq
+                frames += 1
+                arrows = self.classify(latest.image)
+            finally:
+                capture.frames.release(latest)
+            if arrows:
+                print(', '.join(f'{direction} ({score:.2f})' for direction, score in arrows))
+            if self.votes.add(arrows) and self.votes.confidence() >= self.threshold:
+                return self.votes.solution()
+        return []
@@ -0,0 +1,238 @@
+"""
+Hosts the rune model in a separate process, so that preprocessing and inference do not
+compete with the capture thread for the GIL. Frames are passed to the worker through
+shared memory and its predictions are returned over a pipe. The worker is checked
+periodically and restarted whenever it dies or stops responding.
+"""
+
+import time
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from src.detection import detection
+
+
+# The number of seconds between each health check
+HEALTH_CHECK_INTERVAL = 5
+
+# The number of seconds to wait for a reply to a health check
+PING_TIMEOUT = 2
+
+# The number of seconds to wait for an image to be classified
+REQUEST_TIMEOUT = 5
+
+
+class InferenceWorker:
+    """
+    A proxy for the rune model running in a worker process. Only one request is in flight
+    at a time, so a single block of shared memory is reused for every frame.
+    """
+
+    def __init__(self, backend=None, threads=detection.INFERENCE_THREADS,
+                 timeout=REQUEST_TIMEOUT):
+        """
+        Creates a new InferenceWorker without starting its process.
+        :param backend:     The name of the InferenceBackend to load, see LOAD_MODEL.
+        :param threads:     The number of CPU threads to run inference with.
+        :param timeout:     How many seconds a request can take before the worker is restarted.
+        """
+
+        self.backend = backend
+        self.threads = threads
+        self.timeout = timeout
+        self.name = None
+
+        # Spawn rather than fork, which behaves the same on every platform and does not
+        # copy the parent's threads and locks into the worker
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.loaded = None          # A Future that resolves once the worker has loaded its model
+        self.memory = None
+        self.stopped = False
+        self.restarts = 0
+
+        self.thread = threading.Thread(target=self._monitor)
+        self.thread.daemon = True
+
+    def start(self):
+        """
+        Starts the worker process and its health checks.
+        :return:    A Future that resolves to this InferenceWorker once the model has loaded.
+        """
+
+        with self.lock:
+            self._spawn()
+        self.thread.start()
+        future = Future()
+        self.loaded.add_done_callback(lambda f: InferenceWorker._forward(f, future, self))
+        return future
+
+    def stop(self):
+        """Stops the worker process and releases the shared memory."""
+
+        with self.lock:
+            self.stopped = True
+            self._terminate()
+            if self.memory is not None:
+                self.memory.close()
+                self.memory.unlink()
+                self.memory = None
+
+    def classify_arrows(self, image):
+        """
+        Classifies the rune's arrows in IMAGE, see DETECTION.CLASSIFY_ARROWS.
+        :param image:   The full-window image to classify.
+        :return:        A (direction, score) tuple for each arrow, or an empty list if the
+                        worker is unavailable.
+        """
+
+        with self.lock:
+            if self.stopped:
+                return []
+            try:
+                self.loaded.result(timeout=self.timeout)
+            except Exception:
+                return []       # Still loading after a restart, or the model failed to load
+            try:
+                self._write(image)
+                status, value = self._request(('classify', self.memory.name,
+                                               image.shape, image.dtype.str), self.timeout)
+            except Exception as e:
+                self._restart(f'failed to classify a frame ({type(e).__name__}: {e})')
+                return []
+            if status != 'ok':
+                print(f'\n[!] Inference worker could not classify a frame: {value}')
+                return []
+            return value
+
+    def _spawn(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(target=_serve,
+                                            args=(child, self.backend, self.threads))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.loaded = Future()
+        thread = threading.Thread(target=InferenceWorker._await_ready,
+                                  args=(self.conn, self.loaded))
+        thread.daemon = True
+        thread.start()
+
+    def _terminate(self):
+        if self.process is not None:
+            try:
+                self.conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.conn.close()
+            self.process = None
+
+    def _restart(self, reason):
+        self.restarts += 1
+        print(f'\n[!] Inference worker {reason}, restarting')
+        self._terminate()
+        self._spawn()
+
+    def _request(self, message, timeout):
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f'no reply within {timeout} seconds')
+        return self.conn.recv()
+
+    def _write(self, image):
+        """Copies IMAGE into shared memory, growing the block if it is too small."""
+
+        if self.memory is None or self.memory.size < image.nbytes:
+            if self.memory is not None:
+                self.memory.close()
+                self.memory.unlink()
+            self.memory = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        np.copyto(np.ndarray(image.shape, image.dtype, buffer=self.memory.buf), image)
+
+    def _monitor(self):
+        while not self.stopped:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            if not self.lock.acquire(blocking=False):
+                continue        # Busy with a request, which checks the worker by itself
+            try:
+                loaded = self.loaded
+                if self.stopped or not loaded.done() or loaded.exception() is not None:
+                    continue
+                if not self.process.is_alive():
+                    self._restart('exited unexpectedly')
+                    continue
+                try:
+                    self._request(('ping',), PING_TIMEOUT)
+                except Exception:
+                    self._restart('stopped responding')
+            finally:
+                self.lock.release()
+
+    @staticmethod
+    def _await_ready(conn, future):
+        try:
+            status, value = conn.recv()
+        except Exception as e:
+            future.set_exception(RuntimeError(f'Inference worker exited while loading ({e})'))
+            return
+        if status == 'ok':
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(value))
+
+    @staticmethod
+    def _forward(loaded, future, worker):
+        if loaded.exception() is None:
+            worker.name = f'{loaded.result()} (worker process)'
+            future.set_result(worker)
+        else:
+            future.set_exception(loaded.exception())
+
+
+def _serve(conn, backend, threads):
+    """The worker process's main loop, which answers requests until told to stop."""
+
+    try:
+        model = detection.load_model(backend, threads)
+    except Exception as e:
+        conn.send(('error', f'{type(e).__name__}: {e}'))
+        return
+    conn.send(('ok', model.name))
+
+    memory = None
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break       # The bot exited
+        action = message[0]
+        if action == 'stop':
+            break
+        elif action == 'ping':
+            conn.send(('ok', None))
+        elif action == 'classify':
+            _, name, shape, dtype = message
+            try:
+                if memory is None or memory.name != name:
+                    if memory is not None:
+                        memory.close()
+                    memory = shared_memory.SharedMemory(name=name)
+                conn.send(('ok', _classify(model, memory, shape, dtype)))
+            except Exception as e:
+                conn.send(('error', f'{type(e).__name__}: {e}'))
+    if memory is not None:
+        memory.close()
+
+
+def _classify(model, memory, shape, dtype):
+    # Keep the view of shared memory local, so that it is released before the block is closed
+    image = np.ndarray(shape, np.dtype(dtype), buffer=memory.buf)
+    return detection.classify_arrows(model, image)
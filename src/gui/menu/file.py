@@ -31,6 +31,13 @@ class File(MenuBarItem):
             command=utils.async_callback(self, File._load_routine),
             state=tk.DISABLED
         )
+        self.add_separator()
+        self.recording = tk.BooleanVar(value=False)
+        self.add_checkbutton(
+            label='錄製畫面 (Record Session)',
+            variable=self.recording,
+            command=utils.async_callback(self, self._toggle_recording)
+        )
 
     def enable_routine_state(self):
         """當成功讀取職業後，解鎖其他按鈕"""
@@ -38,6 +45,13 @@ class File(MenuBarItem):
         self.entryconfig('儲存腳本 (Save Routine)', state=tk.NORMAL)
         self.entryconfig('載入腳本 (Load Routine)', state=tk.NORMAL)
 
+    def _toggle_recording(self):
+        """開始或停止錄製遊戲畫面，錄下的畫面可用來離線測試辨識功能"""
+        if self.recording.get():
+            config.capture.start_recording()
+        else:
+            config.capture.stop_recording()
+
     @staticmethod
     @utils.run_if_disabled('\n[!] 錯誤：請先停止機器人再執行此動作')
     def _new_routine():
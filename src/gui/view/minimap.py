@@ -17,12 +17,14 @@ class Minimap(LabelFrame):
                                 borderwidth=0, highlightthickness=0)
         self.canvas.pack(expand=True, fill='both', padx=5, pady=5)
         self.container = None
+        self.prev_seq = 0
 
     def display_minimap(self):
-        """Updates the Main page with the current minimap."""
+        """Updates the Main page with the current minimap if a new one has been captured."""
 
         minimap = config.capture.minimap
-        if minimap:
+        if minimap and minimap['seq'] != self.prev_seq:
+            self.prev_seq = minimap['seq']
             rune_active = minimap['rune_active']
             rune_pos = minimap['rune_pos']
             path = minimap['path']
@@ -0,0 +1,211 @@
+"""A module for playing alert sounds without blocking the threads that raise them."""
+
+import os
+import time
+import queue
+import threading
+from src.common import config
+
+
+ALERTS_DIR = os.path.join('assets', 'alerts')
+
+SOUND_EXTENSIONS = ('.mp3', '.ogg', '.wav')
+
+
+class AudioBackend:
+    """Loads and plays sounds. Every method is only ever called from the audio worker."""
+
+    def load(self, path):
+        """Decodes the sound file at PATH and returns a handle that can be played."""
+
+        raise NotImplementedError
+
+    def play(self, sound, volume, loop=False):
+        """Starts playing SOUND at VOLUME, repeating it until stopped if LOOP is True."""
+
+        raise NotImplementedError
+
+    def set_volume(self, sound, volume):
+        """Changes the volume of SOUND while it is playing."""
+
+    def stop(self, sound):
+        """Stops playing SOUND."""
+
+        raise NotImplementedError
+
+
+class PygameAudio(AudioBackend):
+    """Plays sounds through pygame's mixer, keeping every sound decoded in memory."""
+
+    def __init__(self):
+        import pygame
+
+        pygame.mixer.init()
+        self.pygame = pygame
+
+    def load(self, path):
+        return self.pygame.mixer.Sound(path)
+
+    def play(self, sound, volume, loop=False):
+        sound.set_volume(volume)
+        sound.play(loops=-1 if loop else 0)
+
+    def set_volume(self, sound, volume):
+        sound.set_volume(volume)
+
+    def stop(self, sound):
+        sound.stop()
+
+
+class NullAudio(AudioBackend):
+    """Plays nothing, for machines without audio. Remembers what it was asked to play."""
+
+    def __init__(self):
+        self.played = []
+
+    def load(self, path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def play(self, sound, volume, loop=False):
+        self.played.append((sound, volume, loop))
+
+    def stop(self, sound):
+        pass
+
+
+def start_stop_pressed():
+    """Returns whether the key bound to 'Start/stop' is currently held down."""
+
+    import keyboard as kb
+
+    return kb.is_pressed(config.listener.config['Start/stop'])
+
+
+class AlertManager:
+    """
+    Plays alerts and pings from a dedicated audio worker fed by a queue, so that raising
+    an alert returns immediately. Alerts loop until they are acknowledged, growing louder
+    the longer they go unanswered, while pings play once. Repeats of the same sound within
+    a short time of each other are ignored.
+    """
+
+    def __init__(self, backend=None, directory=ALERTS_DIR, debounce=3, escalation_delay=30,
+                 escalation_step=0.25, acknowledged=start_stop_pressed, on_acknowledge=None):
+        """
+        Creates a new AlertManager and preloads every sound in DIRECTORY.
+        :param backend:             The AudioBackend to play sounds with, defaults to pygame,
+                                    or silence if pygame's mixer cannot be initialized.
+        :param directory:           The directory containing the sounds, named after each alert.
+        :param debounce:            The minimum number of seconds between each time a sound plays.
+        :param escalation_delay:    How many seconds an alert can go unacknowledged before
+                                    each increase in its volume.
+        :param escalation_step:     How much to increase an unacknowledged alert's volume by.
+        :param acknowledged:        A function that returns True once the user has noticed
+                                    the current alert.
+        :param on_acknowledge:      A function to call from the audio worker after an alert
+                                    is acknowledged.
+        """
+
+        if backend is None:
+            try:
+                backend = PygameAudio()
+            except Exception as e:
+                print(f'\n[!] Could not initialize audio, alerts will be silent: {e}')
+                backend = NullAudio()
+        self.backend = backend
+        self.debounce = debounce
+        self.escalation_delay = escalation_delay
+        self.escalation_step = escalation_step
+        self.acknowledged = acknowledged
+        self.on_acknowledge = on_acknowledge
+
+        self.sounds = {}
+        if os.path.isdir(directory):
+            for file in sorted(os.listdir(directory)):
+                name, ext = os.path.splitext(file)
+                if ext.lower() in SOUND_EXTENSIONS and name not in self.sounds:
+                    self.sounds[name] = backend.load(os.path.join(directory, file))
+
+        self.requests = queue.Queue()
+        self.last_played = {}
+        self.current = None         # (name, volume, time started, time last escalated)
+        self.thread = threading.Thread(target=self._main)
+        self.thread.daemon = True
+
+    @property
+    def active(self):
+        """Whether an alert is currently playing and waiting to be acknowledged."""
+
+        return self.current is not None
+
+    def start(self):
+        """Starts the audio worker."""
+
+        self.thread.start()
+
+    def alert(self, name, volume=0.75):
+        """Starts looping the sound NAME until the alert is acknowledged."""
+
+        self.requests.put(('alert', name, volume))
+
+    def ping(self, name, volume=0.5):
+        """Plays the sound NAME once."""
+
+        self.requests.put(('ping', name, volume))
+
+    def stop(self):
+        """Acknowledges the current alert, if any."""
+
+        self.requests.put(('stop', None, None))
+
+    def _main(self):
+        while True:
+            try:
+                action, name, volume = self.requests.get(timeout=0.1)
+            except queue.Empty:
+                action = None
+            if action == 'stop':
+                self._acknowledge()
+            elif action is not None:
+                self._play(action, name, volume)
+
+            current = self.current
+            if current is not None:
+                if self.acknowledged():
+                    self._acknowledge()
+                else:
+                    self._escalate()
+
+    def _play(self, action, name, volume):
+        sound = self.sounds.get(name)
+        if sound is None:
+            print(f"\n[!] Unknown alert sound '{name}'")
+            return
+        now = time.time()
+        if now - self.last_played.get(name, 0) < self.debounce:
+            return
+        if self.current is not None:
+            if action == 'ping' or self.current[0] == name:
+                return      # Never interrupt an alert that is still waiting to be acknowledged
+            self.backend.stop(self.sounds[self.current[0]])
+        self.last_played[name] = now
+        self.backend.play(sound, volume, loop=action == 'alert')
+        if action == 'alert':
+            self.current = (name, volume, now, now)
+
+    def _escalate(self):
+        name, volume, started, escalated = self.current
+        now = time.time()
+        if volume < 1 and now - escalated > self.escalation_delay:
+            volume = min(1, volume + self.escalation_step)
+            self.backend.set_volume(self.sounds[name], volume)
+            self.current = (name, volume, started, now)
+
+    def _acknowledge(self):
+        current = self.current
+        if current is None:
+            return
+        self.backend.stop(self.sounds[current[0]])
+        self.current = None
+        if self.on_acknowledge is not None:
+            self.on_acknowledge()
@@ -15,17 +15,22 @@ import importlib
 import traceback
 from os.path import splitext, basename
 from src.common import config, utils
-from src.detection import detection
+from src.common.events import RuneAppeared, RuneExpired, PlayerEntered, PlayerLeft
+from src.detection import detection, matching
+from src.detection.rune import RuneSolver
+from src.detection.worker import InferenceWorker
 from src.routine import components
 from src.routine.routine import Routine
 from src.command_book.command_book import CommandBook
-from src.routine.components import Point
 from src.common.vkeys import press, click
 from src.common.interfaces import Configurable
 
 
 # 讀取「輪」解完後的 Buff 圖示，用來確認有沒有解成功
-RUNE_BUFF_TEMPLATE = cv2.imread('assets/rune_buff_template.jpg', 0)
+matching.register('rune_buff',
+                  cv2.imread('assets/rune_buff_template.jpg', 0),
+                  threshold=0.9,
+                  pyramid=1)
 
 
 class Bot(Configurable):
@@ -39,6 +44,12 @@ class Bot(Configurable):
         'Feed pet': '9'   # 餵寵物鍵
     }
 
+    # 解輪時需要的全畫面截圖頻率 (每秒張數)
+    RUNE_FRAME_RATE = 30
+
+    # 在另一個行程 (Process) 裡執行 AI 模型，解輪時才不會拖慢截圖和追蹤玩家位置
+    RUNE_WORKER_PROCESS = True
+
     def __init__(self):
         """程式啟動時會執行這裡，進行初始化。"""
         super().__init__('keybindings')
@@ -46,7 +57,9 @@ class Bot(Configurable):
 
         self.rune_active = False        # 現在是不是有輪出現？
         self.rune_pos = (0, 0)          # 輪在哪裡？
-        self.rune_closest_pos = (0, 0)  # 離輪最近的腳本點位在哪？
+        self.rune_point = None          # 離輪最近的腳本點位 (Point) 是哪一個？
+        self.rune_points = None         # 找出 rune_point 時用的是哪一份點位索引
+        self.solving = False            # 是不是正在解輪？
         self.submodules = []
         self.command_book = None        # 目前載入的職業指令書
         
@@ -57,20 +70,68 @@ class Bot(Configurable):
         self.thread = threading.Thread(target=self._main)
         self.thread.daemon = True
 
+        # 另一個執行緒專門接收其他模組發出的事件 (例如輪出現)，收到就馬上更新狀態
+        self.events = config.bus.subscribe(RuneAppeared, RuneExpired, PlayerEntered, PlayerLeft)
+        self.event_thread = threading.Thread(target=self._handle_events)
+        self.event_thread.daemon = True
+
     def start(self):
         """按下開始後，啟動機器人的主迴圈。"""
         self.update_submodules()
         print('\n[~] 已啟動機器人主迴圈')
+        self.event_thread.start()
         self.thread.start()
 
+    def _handle_events(self):
+        """
+        處理其他模組發出的事件。只有這裡和解輪的流程會修改輪的狀態，
+        所以不會在解輪解到一半時被別的執行緒重設。
+        """
+        while True:
+            event = self.events.get()
+            if isinstance(event, RuneAppeared):
+                if not self.rune_active:
+                    self.rune_pos = event.pos
+                    self.rune_point = event.closest
+                    self.rune_points = event.points     # 腳本之後如果有變，主迴圈會再重新找一次
+                    self.rune_active = True
+            elif isinstance(event, RuneExpired):
+                if not self.solving:        # 正在解輪時就讓解輪流程自己決定結果
+                    self.rune_active = False
+            elif isinstance(event, (PlayerEntered, PlayerLeft)):
+                config.stage_fright = event.count > 0
+
+    def _resolve_rune_point(self):
+        """
+        回傳離輪最近的腳本點位。腳本重新載入或被修改後，裡面的 Point 都是新的物件，
+        所以只要點位索引換了一份，就重新找一次最近的點位。
+        """
+        points = config.routine.points
+        if points is not self.rune_points:
+            self.rune_points = points
+            self.rune_point = points.nearest(self.rune_pos)
+        return self.rune_point
+
+    @staticmethod
+    def _on_model_loaded(future):
+        """AI 模型在背景載入完成 (或失敗) 時會呼叫這裡。"""
+        if future.exception() is None:
+            print(f'\n[~] AI 模型載入完成！(使用 {future.result().name} 後端)')
+        else:
+            print(f'\n[!] AI 模型載入失敗：{future.exception()}')
+
     def _main(self):
         """
         [核心迴圈]
         這就是機器人一直在做的事情，就像人的心跳一樣不會停。
         """
-        print('\n[~] 正在載入 AI 偵測模型 (這可能需要一點時間)...\n')
-        model = detection.load_model()
-        print('\n[~] AI 模型載入完成！')
+        # 在背景載入 AI 模型，這樣其他模組不用等它就能先啟動，真正要解輪時才需要等待
+        print('\n[~] 正在背景載入 AI 偵測模型 (這可能需要一點時間)...')
+        if Bot.RUNE_WORKER_PROCESS:
+            model = InferenceWorker().start()
+        else:
+            model = detection.load_model_async()
+        model.add_done_callback(Bot._on_model_loaded)
 
         self.ready = True
         config.listener.enabled = True
@@ -102,9 +163,12 @@ class Bot(Configurable):
                 element = config.routine[config.routine.index]
                 
                 # 如果有輪出現，而且我們剛好走到了負責解輪的點位
-                if self.rune_active and isinstance(element, Point) \
-                        and element.location == self.rune_closest_pos:
-                    self._solve_rune(model) # 去解輪！
+                if self.rune_active and element is self._resolve_rune_point():
+                    self.solving = True
+                    try:
+                        self._solve_rune(model) # 去解輪！
+                    finally:
+                        self.solving = False
                 
                 # 5. 執行這個點位的動作 (移動、跳躍、攻擊...)
                 element.execute()
@@ -123,11 +187,22 @@ class Bot(Configurable):
     def _solve_rune(self, model):
         """
         Moves to the position of the rune and solves the arrow-key puzzle.
-        :param model:   The TensorFlow model to classify with.
-        :param sct:     The mss instance object with which to take screenshots.
+        :param model:   A Future that resolves to the InferenceBackend or
+                        InferenceWorker to classify with.
         :return:        None
         """
 
+        # 模型還沒載入完成的話，先等它載入好再去解輪
+        if not model.done():
+            print('\n[~] 等待 AI 模型載入完成...')
+        try:
+            model = model.result()
+        except Exception as e:
+            # 沒有模型就解不了輪，放棄這個輪，免得每一圈都回來這裡原地空轉
+            print(f'\n[!] 無法解輪，AI 模型無法使用：{e}')
+            self.rune_active = False
+            return
+
         move = self.command_book['move']
         move(*self.rune_pos).execute()
         adjust = self.command_book['adjust']
@@ -136,34 +211,34 @@ class Bot(Configurable):
         press(self.config['Interact'], 1, down_time=0.2)        # Inherited from Configurable
 
         print('\nSolving rune:')
-        inferences = []
-        for _ in range(15):
-            frame = config.capture.frame
-            solution = detection.merge_detection(model, frame)
-            if solution:
-                print(', '.join(solution))
-                if solution in inferences:
-                    print('Solution found, entering result')
-                    for arrow in solution:
-                        press(arrow, 1, down_time=0.1)
-                    time.sleep(1)
-                    for _ in range(3):
-                        time.sleep(0.3)
-                        frame = config.capture.frame
-                        rune_buff = utils.multi_match(frame[:frame.shape[0] // 8, :],
-                                                      RUNE_BUFF_TEMPLATE,
-                                                      threshold=0.9)
-                        if rune_buff:
-                            rune_buff_pos = min(rune_buff, key=lambda p: p[0])
-                            target = (
-                                round(rune_buff_pos[0] + config.capture.window['left']),
-                                round(rune_buff_pos[1] + config.capture.window['top'])
-                            )
-                            click(target, button='right')
-                    self.rune_active = False
-                    break
-                elif len(solution) == 4:
-                    inferences.append(solution)
+        config.capture.set_frame_rate('rune', Bot.RUNE_FRAME_RATE)
+        solver = RuneSolver(model)
+        try:
+            solution = solver.solve(config.capture)
+        finally:
+            config.capture.set_frame_rate('rune', None)
+        if solution:
+            print(f'Solution found after {solver.votes.frames} frames, entering result')
+            for arrow in solution:
+                press(arrow, 1, down_time=0.1)
+            time.sleep(1)
+            for _ in range(3):
+                time.sleep(0.3)
+                latest = config.capture.frames.latest(pin=True)
+                try:
+                    height, width = latest.image.shape[:2]
+                    rune_buff = matching.match(latest, 'rune_buff',
+                                               region=(0, 0, width, height // 8))
+                finally:
+                    config.capture.frames.release(latest)
+                if len(rune_buff) > 0:
+                    rune_buff_pos = rune_buff[rune_buff[:, 0].argmin()]
+                    target = (
+                        round(rune_buff_pos[0] + config.capture.window['left']),
+                        round(rune_buff_pos[1] + config.capture.window['top'])
+                    )
+                    click(target, button='right')
+            self.rune_active = False
 
     def load_commands(self, file):
         try:
@@ -1,38 +1,45 @@
 """A module for tracking useful in-game information."""
 
+import os
 import time
 import cv2
 import threading
-import ctypes
-import mss
-import mss.windows
-import numpy as np
 from src.common import config, utils
-from ctypes import wintypes
-user32 = ctypes.windll.user32
-user32.SetProcessDPIAware()
+from src.common.events import PositionUpdated
+from src.detection import matching
+from src.capture.frames import FrameBuffer
+from src.capture.backends import CaptureError, MssBackend
+from src.capture.recorder import Recorder, RECORDINGS_DIR
+from src.capture.tracking import PlayerTracker, PositionEstimator
+from src.capture.calibration import Calibration, CalibrationCache, MMT_WIDTH, MMT_HEIGHT, \
+    find_minimap, verify_minimap
+from datetime import datetime
 
 
-# The distance between the top of the minimap and the top of the screen
-MINIMAP_TOP_BORDER = 5
-
-# The thickness of the other three borders of the minimap
-MINIMAP_BOTTOM_BORDER = 9
-
 # Offset in pixels to adjust for windowed mode
 WINDOWED_OFFSET_TOP = 36
 WINDOWED_OFFSET_LEFT = 10
 
-# The top-left and bottom-right corners of the minimap
-MM_TL_TEMPLATE = cv2.imread('assets/minimap_tl_template.png', 0)
-MM_BR_TEMPLATE = cv2.imread('assets/minimap_br_template.png', 0)
+# The player's symbol on the minimap
+PLAYER_TEMPLATE = matching.register('player',
+                                    cv2.imread('assets/player_template.png', 0),
+                                    threshold=0.8)
+PT_HEIGHT, PT_WIDTH = PLAYER_TEMPLATE.height, PLAYER_TEMPLATE.width
 
-MMT_HEIGHT = max(MM_TL_TEMPLATE.shape[0], MM_BR_TEMPLATE.shape[0])
-MMT_WIDTH = max(MM_TL_TEMPLATE.shape[1], MM_BR_TEMPLATE.shape[1])
+# The rate (in frames per second) at which full-window frames are taken if no consumer asks for more
+DEFAULT_FRAME_RATE = 5
 
-# The player's symbol on the minimap
-PLAYER_TEMPLATE = cv2.imread('assets/player_template.png', 0)
-PT_HEIGHT, PT_WIDTH = PLAYER_TEMPLATE.shape
+# How many full-window frames to wait between each check that the minimap has not moved
+DRIFT_CHECK_FRAMES = 5
+
+# How many consecutive failed checks it takes before the minimap is located again
+DRIFT_TOLERANCE = 3
+
+# The minimum number of seconds between each attempt to locate a moved minimap. The delay
+# doubles after each attempt, up to DRIFT_MAX_RETRY_DELAY, until the minimap is found again,
+# so that a minimap hidden behind a menu or loading screen is not searched for every second
+DRIFT_RETRY_DELAY = 1
+DRIFT_MAX_RETRY_DELAY = 60
 
 
 class Capture:
@@ -42,16 +49,25 @@ class Capture:
     displays the minimap in a pop-up window.
     """
 
-    def __init__(self):
-        """Initializes this Capture object's main thread."""
+    def __init__(self, backend=None):
+        """
+        Initializes this Capture object's main thread.
+        :param backend:     The CaptureBackend to take frames from, defaults to the game window.
+        """
 
         config.capture = self
+        self.backend = MssBackend() if backend is None else backend
 
         self.frame = None
         self.minimap = {}
-        self.minimap_ratio = 1
+        self.calibration = None
         self.minimap_sample = None
-        self.sct = None
+        self.frame_rates = {}
+        self.frames = FrameBuffer()
+        self.minimaps = FrameBuffer()
+        self.recorder = None
+        self.tracker = PlayerTracker(PLAYER_TEMPLATE)
+        self.estimator = PositionEstimator()
         self.window = {
             'left': 0,
             'top': 0,
@@ -59,6 +75,14 @@ class Capture:
             'height': 768
         }
 
+        self.calibration_cache = CalibrationCache()
+        self.calibration_event = threading.Event()
+        self.pending_calibration = None
+        self.drift_failures = 0
+        self.drift_attempt = 0
+        self.drift_delay = DRIFT_RETRY_DELAY
+        self.drift_thread = None
+
         self.ready = False
         self.calibrated = False
         self.thread = threading.Thread(target=self._main)
@@ -70,17 +94,86 @@ class Capture:
         print('\n[~] Started video capture')
         self.thread.start()
 
+    @property
+    def minimap_ratio(self):
+        """The width of the minimap divided by its height."""
+
+        calibration = self.calibration
+        return calibration.ratio if calibration else 1
+
+    def set_frame_rate(self, consumer, rate):
+        """
+        Requests full-window frames to be taken at least RATE times per second on
+        behalf of CONSUMER. The minimap is always captured as fast as possible.
+        :param consumer:    A unique name identifying the module making the request.
+        :param rate:        The desired frame rate, or None to withdraw the request.
+        :return:            None
+        """
+
+        if rate:
+            self.frame_rates[consumer] = rate
+        else:
+            self.frame_rates.pop(consumer, None)
+
+    def frame_interval(self):
+        """Returns the number of seconds to wait between each full-window frame."""
+
+        return 1 / max(DEFAULT_FRAME_RATE, *self.frame_rates.values(), 0)
+
+    def wait_for_frame(self, after_seq=0, timeout=None, pin=False):
+        """
+        Blocks until a full-window frame newer than AFTER_SEQ has been taken.
+        :param after_seq:   The sequence id of the last frame that the caller has processed.
+        :param timeout:     The maximum number of seconds to wait, or None to wait forever.
+        :param pin:         Whether to pin the Frame until it is passed to FRAMES.RELEASE.
+        :return:            The newest Frame, otherwise None if TIMEOUT expired.
+        """
+
+        return self.frames.wait_for_frame(after_seq, timeout, pin)
+
+    def wait_for_minimap(self, after_seq=0, timeout=None, pin=False):
+        """Blocks until a minimap frame newer than AFTER_SEQ has been taken."""
+
+        return self.minimaps.wait_for_frame(after_seq, timeout, pin)
+
+    def recalibrate(self):
+        """Makes the capture thread locate the minimap again and blocks until it has."""
+
+        self.calibration_event.clear()
+        self.calibrated = False
+        self.calibration_event.wait()
+
+    def start_recording(self, directory=None, video=False):
+        """
+        Starts saving every full-window frame to disk, along with the bot's state at that time.
+        :param directory:   The directory to record to, defaults to a new timestamped directory.
+        :param video:       Whether to encode the frames as a video instead of .npz chunks.
+        :return:            None
+        """
+
+        if self.recorder is not None:
+            return
+        if directory is None:
+            name = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+            directory = os.path.join(RECORDINGS_DIR, name)
+        recorder = Recorder(directory, video=video, fps=1 / self.frame_interval())
+        recorder.start()
+        self.recorder = recorder
+
+    def stop_recording(self):
+        """Stops the current recording, if any, once all of its frames have been written."""
+
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = None
+            recorder.stop()
+
     def _main(self):
         """Constantly monitors the player's position and in-game events."""
 
-        mss.windows.CAPTUREBLT = 0
         while True:
             # Calibrate screen capture
-            handle = user32.FindWindowW(None, 'MapleStory')
-            rect = wintypes.RECT()
-            user32.GetWindowRect(handle, ctypes.pointer(rect))
-            rect = (rect.left, rect.top, rect.right, rect.bottom)
-            rect = tuple(max(0, x) for x in rect)
+            rect = tuple(max(0, x) for x in self.backend.find_window())
 
             self.window['left'] = rect[0]
             self.window['top'] = rect[1]
@@ -88,59 +181,167 @@ class Capture:
             self.window['height'] = max(rect[3] - rect[1], MMT_HEIGHT)
 
             # Calibrate by finding the top-left and bottom-right corners of the minimap
-            with mss.mss() as self.sct:
+            with self.backend:
+                self.backend.advance()
                 self.frame = self.screenshot()
             if self.frame is None:
                 continue
-            tl, _ = utils.single_match(self.frame, MM_TL_TEMPLATE)
-            _, br = utils.single_match(self.frame, MM_BR_TEMPLATE)
-            mm_tl = (
-                tl[0] + MINIMAP_BOTTOM_BORDER,
-                tl[1] + MINIMAP_TOP_BORDER
-            )
-            mm_br = (
-                max(mm_tl[0] + PT_WIDTH, br[0] - MINIMAP_BOTTOM_BORDER),
-                max(mm_tl[1] + PT_HEIGHT, br[1] - MINIMAP_BOTTOM_BORDER)
-            )
-            self.minimap_ratio = (mm_br[0] - mm_tl[0]) / (mm_br[1] - mm_tl[1])
-            self.minimap_sample = self.frame[mm_tl[1]:mm_br[1], mm_tl[0]:mm_br[0]]
+
+            # Reuse the previous calibration for this window size and map if it still holds
+            cached = self.calibration_cache.get(self._calibration_key())
+            if cached and verify_minimap(self.frame, *cached):
+                calibration = Calibration(*cached, self.window)
+            else:
+                calibration = self._locate_minimap(self.frame)
+            self._apply_calibration(calibration, self.frame)
             self.calibrated = True
+            self.calibration_event.set()
 
-            with mss.mss() as self.sct:
+            with self.backend:
+                last_frame = time.time()
                 while True:
                     if not self.calibrated:
                         break
+                    if self.pending_calibration is not None:
+                        calibration, frame = self.pending_calibration
+                        self.pending_calibration = None
+                        self._apply_calibration(calibration, frame)
+                    self.backend.advance()
 
-                    # Take screenshot
-                    self.frame = self.screenshot()
-                    if self.frame is None:
-                        continue
+                    # Take a full-window screenshot only as often as consumers need it
+                    now = time.time()
+                    if now - last_frame >= self.frame_interval():
+                        frame = self.screenshot()
+                        if frame is not None:
+                            latest = self.frames.write(frame, now)
+                            self.frame = latest.image
+                            last_frame = now
+                            if latest.seq % DRIFT_CHECK_FRAMES == 0:
+                                self._check_drift(self.frame)
+                            recorder = self.recorder
+                            if recorder is not None:
+                                recorder.submit(self.frame,
+                                                now,
+                                                config.player_pos,
+                                                config.bot is not None and config.bot.rune_active,
+                                                config.path)
 
-                    # Crop the frame to only show the minimap
-                    minimap = self.frame[mm_tl[1]:mm_br[1], mm_tl[0]:mm_br[0]]
+                    # Capture only the minimap to track the player
+                    taken = time.time()
+                    minimap = self.screenshot(self.calibration.region)
+                    if minimap is None:
+                        continue
+                    latest = self.minimaps.write(minimap, taken)
+                    minimap = latest.image
 
                     # Determine the player's position
-                    player = utils.multi_match(minimap, PLAYER_TEMPLATE, threshold=0.8)
+                    player, confidence = self.tracker.locate(minimap)
                     if player:
-                        config.player_pos = utils.convert_to_relative(player[0], minimap)
+                        measured = utils.convert_to_relative(player, minimap)
+                        config.player_pos = self.estimator.update(measured, latest.timestamp)
+                        config.player_velocity = self.estimator.velocity
+                        config.bus.publish(PositionUpdated(config.player_pos,
+                                                           config.player_velocity,
+                                                           latest.timestamp))
 
                     # Package display information to be polled by GUI
+                    bot = config.bot
                     self.minimap = {
-                        'minimap': minimap,
-                        'rune_active': config.bot.rune_active,
-                        'rune_pos': config.bot.rune_pos,
+                        'seq': latest.seq,
+                        'minimap': minimap.copy(),      # The slot is reused by later frames
+                        'rune_active': bot is not None and bot.rune_active,
+                        'rune_pos': bot.rune_pos if bot is not None else (0, 0),
                         'path': config.path,
-                        'player_pos': config.player_pos
+                        'player_pos': config.player_pos,
+                        'player_confidence': confidence
                     }
 
                     if not self.ready:
                         self.ready = True
                     time.sleep(0.001)
 
-    def screenshot(self, delay=1):
+    def _calibration_key(self):
+        """Returns the key under which the current window size and map are cached."""
+
+        return (self.window['width'], self.window['height'],
+                config.layout.name if config.layout else '')
+
+    def _locate_minimap(self, frame):
+        """Searches all of FRAME for the minimap and caches it if it was found."""
+
+        mm_tl, mm_br = find_minimap(frame, PT_WIDTH, PT_HEIGHT)
+        if verify_minimap(frame, mm_tl, mm_br):
+            self.calibration_cache.put(self._calibration_key(), mm_tl, mm_br)
+        return Calibration(mm_tl, mm_br, self.window)
+
+    def _apply_calibration(self, calibration, frame):
+        """Switches to CALIBRATION, which was derived from FRAME. Must run on the capture thread."""
+
+        self.minimap_sample = calibration.crop(frame)
+        self.calibration = calibration
+        self.tracker.reset()
+        self.estimator.reset()
+        self.drift_failures = 0
+
+    def _check_drift(self, frame):
+        """
+        Verifies that the minimap is still where it was calibrated to be in FRAME. If it has
+        moved or been resized for several checks in a row, locates it again on a background
+        thread so that capturing can continue in the meantime.
+        """
+
+        if self.calibration.verify(frame):
+            self.drift_failures = 0
+            self.drift_delay = DRIFT_RETRY_DELAY
+            return
+        self.drift_failures += 1
+        now = time.time()
+        if self.drift_failures >= DRIFT_TOLERANCE \
+                and now - self.drift_attempt > self.drift_delay \
+                and (self.drift_thread is None or not self.drift_thread.is_alive()):
+            self.drift_attempt = now
+            self.drift_delay = min(2 * self.drift_delay, DRIFT_MAX_RETRY_DELAY)
+            self.drift_thread = threading.Thread(target=self._recalibrate_in_background,
+                                                 args=(frame.copy(),))
+            self.drift_thread.daemon = True
+            self.drift_thread.start()
+
+    def _recalibrate_in_background(self, frame):
+        calibration = self._locate_minimap(frame)
+        if calibration.verify(frame):
+            print('\n[~] Minimap moved or resized, recalibrated automatically')
+            self.pending_calibration = (calibration, frame)
+
+    def screenshot(self, region=None, delay=1):
+        """
+        Takes a screenshot of REGION, or of the entire game window if REGION is not provided.
+        :param region:  A dictionary describing the area of the screen to capture.
+        :param delay:   The number of seconds to wait before retrying after an error.
+        :return:        The screenshot as a BGRA array, otherwise None if an error occurred.
+        """
+
+        if region is None:
+            region = self.window
         try:
-            return np.array(self.sct.grab(self.window))
-        except mss.exception.ScreenShotError:
+            return self.backend.grab(region)
+        except CaptureError:
             print(f'\n[!] Error while taking screenshot, retrying in {delay} second'
                   + ('s' if delay != 1 else ''))
             time.sleep(delay)
+
+
+# Profiles the capture loop headlessly against a recorded session
+if __name__ == '__main__':
+    import sys
+    from src.capture.backends import ReplayBackend
+
+    capture = Capture(ReplayBackend(sys.argv[1], realtime=False))
+    capture.start()
+    while not capture.ready:
+        time.sleep(0.01)
+    start, start_seq = time.time(), capture.minimaps.seq
+    while not capture.backend.finished:
+        time.sleep(0.01)
+    elapsed = time.time() - start
+    print(f'[~] Tracked {capture.minimaps.seq - start_seq} minimap frames '
+          f'in {elapsed:.2f} seconds ({(capture.minimaps.seq - start_seq) / elapsed:.1f} FPS)')
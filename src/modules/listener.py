@@ -6,6 +6,7 @@ import winsound
 import keyboard as kb
 from src.common.interfaces import Configurable
 from src.common import config, utils
+from src.common.events import RuneExpired
 from datetime import datetime
 
 
@@ -71,7 +72,7 @@ class Listener(Configurable):
     def toggle_enabled():
         """Resumes or pauses the current routine. Plays a sound to notify the user."""
 
-        config.bot.rune_active = False
+        config.bus.publish(RuneExpired())
 
         if not config.enabled:
             Listener.recalibrate_minimap()      # Recalibrate only when being enabled.
@@ -97,9 +98,7 @@ class Listener(Configurable):
 
     @staticmethod
     def recalibrate_minimap():
-        config.capture.calibrated = False
-        while not config.capture.calibrated:
-            time.sleep(0.01)
+        config.capture.recalibrate()
         config.gui.edit.minimap.redraw()
 
     @staticmethod
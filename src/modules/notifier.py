@@ -1,144 +1,249 @@
 """A module for detecting and notifying the user of dangerous in-game events."""
 
 from src.common import config, utils
+from src.common.events import RuneAppeared, RuneExpired, PlayerEntered, PlayerLeft, \
+    EliteBoss, MapChanged
+from src.detection import matching
+from src.detection.detectors import Detector, DetectorScheduler
+from src.modules.alerts import AlertManager
 import time
-import os
 import cv2
-import pygame
 import threading
-import numpy as np
-import keyboard as kb
-from src.routine.components import Point
 
 
 # A rune's symbol on the minimap
 RUNE_RANGES = (
     ((141, 148, 245), (146, 158, 255)),
 )
-rune_filtered = utils.filter_color(cv2.imread('assets/rune_template.png'), RUNE_RANGES)
-RUNE_TEMPLATE = cv2.cvtColor(rune_filtered, cv2.COLOR_BGR2GRAY)
+matching.register('rune',
+                  cv2.imread('assets/rune_template.png'),
+                  ranges=RUNE_RANGES,
+                  threshold=0.9)
 
 # Other players' symbols on the minimap
 OTHER_RANGES = (
     ((0, 245, 215), (10, 255, 255)),
 )
-other_filtered = utils.filter_color(cv2.imread('assets/other_template.png'), OTHER_RANGES)
-OTHER_TEMPLATE = cv2.cvtColor(other_filtered, cv2.COLOR_BGR2GRAY)
+matching.register('other',
+                  cv2.imread('assets/other_template.png'),
+                  ranges=OTHER_RANGES,
+                  threshold=0.5)
 
 # The Elite Boss's warning sign
-ELITE_TEMPLATE = cv2.imread('assets/elite_template.jpg', 0)
+matching.register('elite',
+                  cv2.imread('assets/elite_template.jpg', 0),
+                  threshold=0.9,
+                  pyramid=2)
 
 
-def get_alert_path(name):
-    return os.path.join(Notifier.ALERTS_DIR, f'{name}.mp3')
+# The fraction of the screen that must be black for it to count as a map change
+ROOM_CHANGE_THRESHOLD = 0.9
 
 
 class Notifier:
-    ALERTS_DIR = os.path.join('assets', 'alerts')
-
-    def __init__(self):
-        """Initializes this Notifier object's main thread."""
+    def __init__(self, audio=None):
+        """
+        Initializes this Notifier object's main thread.
+        :param audio:   The AudioBackend to play alerts with, defaults to pygame.
+        """
 
-        pygame.mixer.init()
-        self.mixer = pygame.mixer.music
+        config.notifier = self
+        self.alerts = AlertManager(audio, on_acknowledge=Notifier._on_acknowledge)
 
         self.ready = False
         self.thread = threading.Thread(target=self._main)
         self.thread.daemon = True
 
-        self.room_change_threshold = 0.9
+        self.room_change_threshold = ROOM_CHANGE_THRESHOLD
         self.rune_alert_delay = 270         # 4.5 minutes
 
+        self.scheduler = DetectorScheduler()
+        for detector in (BlackScreen(), EliteWarning(), OtherPlayers(), Rune(), RuneTimeout()):
+            self.scheduler.register(detector, group='notifier')
+
     def start(self):
         """Starts this Notifier's thread."""
 
         print('\n[~] Started notifier')
+        self.alerts.start()
         self.thread.start()
 
     def _main(self):
         self.ready = True
-        prev_others = 0
-        rune_start_time = time.time()
+        last_seq = 0
         while True:
-            if config.enabled:
-                frame = config.capture.frame
-                height, width, _ = frame.shape
-                minimap = config.capture.minimap['minimap']
-
-                # Check for unexpected black screen
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                if np.count_nonzero(gray < 15) / height / width > self.room_change_threshold:
-                    self._alert('siren')
-
-                # Check for elite warning
-                elite_frame = frame[height // 4:3 * height // 4, width // 4:3 * width // 4]
-                elite = utils.multi_match(elite_frame, ELITE_TEMPLATE, threshold=0.9)
-                if len(elite) > 0:
-                    self._alert('siren')
-
-                # Check for other players entering the map
-                filtered = utils.filter_color(minimap, OTHER_RANGES)
-                others = len(utils.multi_match(filtered, OTHER_TEMPLATE, threshold=0.5))
-                config.stage_fright = others > 0
-                if others != prev_others:
-                    if others > prev_others:
-                        self._ping('ding')
-                    prev_others = others
-
-                # Check for rune
-                now = time.time()
-                if not config.bot.rune_active:
-                    filtered = utils.filter_color(minimap, RUNE_RANGES)
-                    matches = utils.multi_match(filtered, RUNE_TEMPLATE, threshold=0.9)
-                    rune_start_time = now
-                    if matches and config.routine.sequence:
-                        abs_rune_pos = (matches[0][0], matches[0][1])
-                        config.bot.rune_pos = utils.convert_to_relative(abs_rune_pos, minimap)
-                        distances = list(map(distance_to_rune, config.routine.sequence))
-                        index = np.argmin(distances)
-                        config.bot.rune_closest_pos = config.routine[index].location
-                        config.bot.rune_active = True
-                        self._ping('rune_appeared', volume=0.75)
-                elif now - rune_start_time > self.rune_alert_delay:     # Alert if rune hasn't been solved
-                    config.bot.rune_active = False
-                    self._alert('siren')
-            time.sleep(0.05)
-
-    def _alert(self, name, volume=0.75):
+            if config.enabled or self.alerts.active:     # Keep watching while an alert plays
+                config.capture.set_frame_rate('notifier', self.scheduler.frame_rate('frame'))
+                latest = config.capture.wait_for_frame(last_seq, timeout=0.5, pin=True)
+                if latest is None:
+                    continue
+                last_seq = latest.seq
+                minimap = config.capture.minimaps.latest(pin=True)
+                try:
+                    self.scheduler.run({'frame': latest, 'minimap': minimap})
+                finally:
+                    config.capture.frames.release(latest)
+                    config.capture.minimaps.release(minimap)
+            else:
+                time.sleep(0.05)
+
+    def alert(self, name, volume=0.75):
         """
-        Plays an alert to notify user of a dangerous event. Stops the alert
-        once the key bound to 'Start/stop' is pressed.
+        Disables the bot and plays an alert to notify user of a dangerous event. Returns
+        immediately, and the alert keeps playing until the key bound to 'Start/stop' is pressed.
         """
 
         config.enabled = False
         config.listener.enabled = False
-        self.mixer.load(get_alert_path(name))
-        self.mixer.set_volume(volume)
-        self.mixer.play(-1)
-        while not kb.is_pressed(config.listener.config['Start/stop']):
-            time.sleep(0.1)
-        self.mixer.stop()
-        time.sleep(2)
-        config.listener.enabled = True
+        self.alerts.alert(name, volume)
 
-    def _ping(self, name, volume=0.5):
+    def ping(self, name, volume=0.5):
         """A quick notification for non-dangerous events."""
 
-        self.mixer.load(get_alert_path(name))
-        self.mixer.set_volume(volume)
-        self.mixer.play()
+        self.alerts.ping(name, volume)
+
+    @staticmethod
+    def _on_acknowledge():
+        """
+        Re-enables the listener shortly after an alert is stopped by the 'Start/stop' key.
+        Runs on the audio worker, so the delay is left to a timer instead of blocking it.
+        """
+
+        timer = threading.Timer(2, Notifier._enable_listener)
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def _enable_listener():
+        config.listener.enabled = True
 
 
 #################################
-#       Helper Functions        #
+#           Detectors           #
 #################################
-def distance_to_rune(point):
+class BlackScreen(Detector):
     """
-    Calculates the distance from POINT to the rune.
-    :param point:   The position to check.
-    :return:        The distance from POINT to the rune, infinity if it is not a Point object.
+    Alerts if the screen unexpectedly goes black, such as after being moved to another map.
+    Only a sparse grid of pixels is checked, which is cheaper than checking for changes first.
     """
 
-    if isinstance(point, Point):
-        return utils.distance(config.bot.rune_pos, point.location)
-    return float('inf')
+    frequency = 5
+    priority = 2
+    scale = None
+    step = 8                # The distance in pixels between each sampled pixel
+
+    def detect(self, frame):
+        if utils.dark_fraction(frame.image, step=self.step) > config.notifier.room_change_threshold:
+            config.bus.publish(MapChanged())
+            config.notifier.alert('siren')
+
+
+class EliteWarning(Detector):
+    """Alerts if the Elite Boss's warning sign appears in the middle of the screen."""
+
+    frequency = 10
+    priority = 2
+    budget = 0.01
+
+    def region(self, frame):
+        height, width = frame.image.shape[:2]
+        return width // 4, height // 4, 3 * width // 4, 3 * height // 4
+
+    def detect(self, frame):
+        if len(matching.match(frame, 'elite', region=self.region(frame))) > 0:
+            config.bus.publish(EliteBoss())
+            config.notifier.alert('siren')
+
+
+class OtherPlayers(Detector):
+    """Pings when another player enters the map, and publishes each change in their number."""
+
+    source = 'minimap'
+    frequency = 5
+    priority = 1
+    scale = 2
+
+    def __init__(self):
+        super().__init__()
+        self.prev_others = 0
+
+    def detect(self, frame):
+        others = len(matching.match(frame, 'other'))
+        if others != self.prev_others:
+            if others > self.prev_others:
+                config.bus.publish(PlayerEntered(others))
+                config.notifier.ping('ding')
+            else:
+                config.bus.publish(PlayerLeft(others))
+            self.prev_others = others
+
+
+class Rune(Detector):
+    """Looks for a rune on the minimap and tells the bot which Point is closest to it."""
+
+    source = 'minimap'
+    frequency = 5
+    max_staleness = 2
+    priority = 1
+    scale = 2
+
+    def detect(self, frame):
+        if config.bot.rune_active or not config.routine.sequence:
+            return
+        matches = matching.match(frame, 'rune')
+        if len(matches) > 0:
+            abs_rune_pos = (matches[0][0], matches[0][1])
+            rune_pos = utils.convert_to_relative(abs_rune_pos, frame.image)
+            points = config.routine.points
+            closest = points.nearest(rune_pos)
+            if closest is not None:
+                config.bus.publish(RuneAppeared(rune_pos, closest, points))
+                config.notifier.ping('rune_appeared', volume=0.75)
+
+
+class RuneTimeout(Detector):
+    """Alerts if a rune has been active for too long without being solved."""
+
+    source = 'minimap'
+    scale = None
+
+    def __init__(self):
+        super().__init__()
+        self.rune_start_time = time.time()
+
+    def detect(self, frame):
+        now = time.time()
+        if not config.bot.rune_active:
+            self.rune_start_time = now
+        elif now - self.rune_start_time > config.notifier.rune_alert_delay:
+            self.rune_start_time = now
+            config.bus.publish(RuneExpired())
+            config.notifier.alert('siren')
+
+
+# Validates the sampled black screen check against every pixel of a recorded session
+if __name__ == '__main__':
+    import sys
+    from src.capture.backends import ReplayBackend
+
+    backend = ReplayBackend(sys.argv[1], realtime=False)
+    threshold = ROOM_CHANGE_THRESHOLD
+    steps = (2, 4, 8, 16, 32)
+    errors = {step: 0 for step in steps}
+    mismatches = {step: 0 for step in steps}
+    frames = black = 0
+    with backend:
+        while not backend.finished:
+            image = backend.frame
+            exact = utils.dark_fraction(image)
+            frames += 1
+            black += exact > threshold
+            for step in steps:
+                estimate = utils.dark_fraction(image, step=step)
+                errors[step] = max(errors[step], abs(estimate - exact))
+                mismatches[step] += (estimate > threshold) != (exact > threshold)
+            backend.advance()
+    print(f'[~] Checked {frames} frames, {black} of which were black screens')
+    for step in steps:
+        print(f' -  Step {step}: maximum error {errors[step]:.4f}, '
+              f'{mismatches[step]} misclassified frames')
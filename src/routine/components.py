@@ -247,13 +247,14 @@ class Move(Command):
         for i, point in enumerate(path):
             toggle = True
             self.prev_direction = ''
-            local_error = utils.distance(config.player_pos, point)
-            global_error = utils.distance(config.player_pos, self.target)
+            position = utils.predicted_player_pos()
+            local_error = utils.distance(position, point)
+            global_error = utils.distance(position, self.target)
             while config.enabled and counter > 0 and \
                     local_error > settings.move_tolerance and \
                     global_error > settings.move_tolerance:
                 if toggle:
-                    d_x = point[0] - config.player_pos[0]
+                    d_x = point[0] - position[0]
                     if abs(d_x) > settings.move_tolerance / math.sqrt(2):
                         if d_x < 0:
                             key = 'left'
@@ -265,9 +266,9 @@ class Move(Command):
                             config.layout.add(*config.player_pos)
                         counter -= 1
                         if i < len(path) - 1:
-                            time.sleep(0.15)
+                            wait_for_position(0.15)
                 else:
-                    d_y = point[1] - config.player_pos[1]
+                    d_y = point[1] - position[1]
                     if abs(d_y) > settings.move_tolerance / math.sqrt(2):
                         if d_y < 0:
                             key = 'up'
@@ -279,9 +280,10 @@ class Move(Command):
                             config.layout.add(*config.player_pos)
                         counter -= 1
                         if i < len(path) - 1:
-                            time.sleep(0.05)
-                local_error = utils.distance(config.player_pos, point)
-                global_error = utils.distance(config.player_pos, self.target)
+                            wait_for_position(0.05)
+                position = utils.predicted_player_pos()
+                local_error = utils.distance(position, point)
+                global_error = utils.distance(position, self.target)
                 toggle = not toggle
             if self.prev_direction:
                 key_up(self.prev_direction)
@@ -308,6 +310,27 @@ def step(direction, target):
     config.enabled = False
 
 
+def wait_for_position(timeout):
+    """
+    Waits until a minimap has been captured after the most recent inputs could have taken effect,
+    so that the player's position reflects them. Waits for at most TIMEOUT seconds.
+    :param timeout:     The maximum number of seconds to wait.
+    :return:            None
+    """
+
+    now = time.time()
+    target = now + settings.input_latency
+    deadline = now + timeout
+    latest = config.capture.minimaps.latest()
+    seq = latest.seq if latest else 0
+    while now < deadline:
+        latest = config.capture.wait_for_minimap(seq, deadline - now)
+        if latest is None or latest.timestamp >= target:
+            return
+        seq = latest.seq
+        now = time.time()
+
+
 class Wait(Command):
     """Waits for a set amount of time."""
 
@@ -2,6 +2,7 @@
 
 from src.common import config, settings, utils
 import csv
+import numpy as np
 from os.path import splitext, basename
 from src.routine.components import Point, Label, Jump, Setting, Command, SYMBOLS
 from src.routine.layout import Layout
@@ -15,6 +16,7 @@ def update(func):
 
     def f(self, *args, **kwargs):
         result = func(self, *args, **kwargs)
+        self.point_index = None
         config.gui.set_routine(self.display)
         config.gui.view.details.update_details()
         return result
@@ -41,6 +43,17 @@ class Routine:
         self.index = 0
         self.sequence = []
         self.display = []       # Updated alongside sequence
+        self.point_index = None     # Rebuilt on demand after each change to sequence
+
+    @property
+    def points(self):
+        """A PointIndex of every Point currently in this routine."""
+
+        index = self.point_index
+        if index is None:
+            index = PointIndex(self.sequence)
+            self.point_index = index
+        return index
 
     @dirty
     @update
@@ -284,3 +297,47 @@ class Routine:
 
     def __len__(self):
         return len(self.sequence)
+
+
+class PointIndex:
+    """
+    A snapshot of the locations of every Point in a routine, which answers nearest-Point
+    queries with a single vectorized distance computation.
+    """
+
+    def __init__(self, sequence):
+        """
+        Creates a new PointIndex.
+        :param sequence:    The routine's sequence of Components.
+        """
+
+        self.indices = [i for i, c in enumerate(sequence) if isinstance(c, Point)]
+        self.points = [sequence[i] for i in self.indices]
+        self.locations = np.array([p.location for p in self.points], dtype=np.float64)
+        self.locations = self.locations.reshape(-1, 2)
+
+    def distances(self, pos):
+        """Returns the distance from POS to each Point, in the same order as self.points."""
+
+        return np.hypot(self.locations[:, 0] - pos[0], self.locations[:, 1] - pos[1])
+
+    def nearest(self, pos):
+        """Returns the Point closest to POS, or None if there are no Points."""
+
+        if not self.points:
+            return None
+        return self.points[int(np.argmin(self.distances(pos)))]
+
+    def k_nearest(self, pos, k):
+        """Returns up to K Points sorted by their distance to POS, closest first."""
+
+        k = min(k, len(self.points))
+        if k == 0:
+            return []
+        distances = self.distances(pos)
+        closest = np.argpartition(distances, k - 1)[:k]
+        closest = closest[np.argsort(distances[closest], kind='stable')]
+        return [self.points[i] for i in closest]
+
+    def __len__(self):
+        return len(self.points)
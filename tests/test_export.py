@@ -0,0 +1,87 @@
+"""
+Checks that every exported copy of the rune model gives the same raw detections as the
+original SavedModel on a recording of rune puzzles. Run from the repository's root with:
+
+    python -m unittest discover tests
+
+The recording defaults to assets/recordings/rune and can be overridden by setting the
+RUNE_RECORDING environment variable. Backends whose model has not been exported, or whose
+runtime is not installed, are skipped.
+"""
+
+import os
+import importlib.util
+import unittest
+import numpy as np
+from src.detection import detection, export
+
+
+RECORDING = os.environ.get('RUNE_RECORDING', os.path.join('assets', 'recordings', 'rune'))
+
+RUNTIMES = {'onnx': 'onnxruntime', 'tflite': 'tensorflow'}
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+class TestCompare(unittest.TestCase):
+    """Checks that the comparison itself catches differences."""
+
+    def setUp(self):
+        self.expected = np.array([
+            [0.9, 1, 0.1, 0.1, 0.2, 0.2],
+            [0.89, 3, 0.1, 0.3, 0.2, 0.4],
+            [0.05, 2, 0.5, 0.5, 0.9, 0.9]
+        ])
+
+    def test_identical(self):
+        self.assertIsNone(export.compare(self.expected, self.expected.copy()))
+
+    def test_close_scores_swapped(self):
+        actual = self.expected[[1, 0, 2]]
+        actual[:2, 0] = self.expected[:2, 0]
+        self.assertIsNone(export.compare(self.expected, actual))
+
+    def test_empty(self):
+        self.assertIsNotNone(export.compare(self.expected, self.expected[:0]))
+
+    def test_score(self):
+        actual = self.expected.copy()
+        actual[2, 0] += 0.1
+        self.assertIsNotNone(export.compare(self.expected, actual))
+
+    def test_box(self):
+        actual = self.expected.copy()
+        actual[1, 3] += 0.05
+        self.assertIsNotNone(export.compare(self.expected, actual))
+
+    def test_class(self):
+        actual = self.expected.copy()
+        actual[0, 1] = 2
+        self.assertIsNotNone(export.compare(self.expected, actual))
+
+
+@unittest.skipUnless(installed('tensorflow'), 'TensorFlow is required to run the original model')
+@unittest.skipUnless(os.path.exists(RECORDING), f"No recording at '{RECORDING}'")
+class TestExportedModels(unittest.TestCase):
+    """Compares each exported model against the SavedModel."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.images = export.sample_images(RECORDING)
+
+    def test_backends(self):
+        for backend, runtime in RUNTIMES.items():
+            with self.subTest(backend=backend):
+                if not os.path.exists(detection.BACKENDS[backend][1]):
+                    self.skipTest(f'The {backend} model has not been exported')
+                if not installed(runtime):
+                    self.skipTest(f'{runtime} is not installed')
+                mismatches, confident = export.verify(backend, self.images)
+                self.assertGreater(confident, 0, 'The recording does not contain any arrows')
+                self.assertEqual(mismatches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()